@@ -0,0 +1,167 @@
+"""
+MICROBENCHMARKS DEL ANALIZADOR DE CORREOS
+Ejecutar con: python benchmark_correos.py [cantidad_correos]
+
+Genera un corpus sintético (determinista) y mide la Capa 1 contra la
+implementación anterior, verificando que ambas den EXACTAMENTE lo mismo.
+"""
+import random
+import re
+import sys
+import time
+
+from analizador_correos import AnalizadorCorreos
+
+
+# ================================================================
+# CORPUS SINTÉTICO
+# ================================================================
+
+REMITENTES = [
+    'profesor.garcia@pucp.edu.pe', 'rrhh@empresa.com.pe', 'noreply@tienda.com',
+    'newsletter@noticias.com', 'juan.perez@gmail.com', 'mesa.partes@sunat.gob.pe',
+    'deals@promo-store.com', 'ana@company.com', 'soporte@banco.com'
+]
+
+ASUNTOS = [
+    'Entrevista - segunda etapa del proceso de selección',
+    '50% OFF solo por hoy', 'Recordatorio de pago de factura vencida',
+    'Entrega del proyecto final del curso', 'Hola', 'Ganador del sorteo mensual',
+    'Firma de contrato pendiente para el lunes', 'Reunión de equipo',
+    'Tu constancia de trámite está lista'
+]
+
+FRASES = [
+    'Te escribo para coordinar los detalles de la reunión.',
+    'Por favor responder antes del viernes con la información solicitada.',
+    'Necesito que revises el documento adjunto cuanto antes.',
+    'Haz click here para ver todas nuestras ofertas exclusivas.',
+    'Si no deseas recibir más correos puedes darse de baja aquí.',
+    'El plazo de entrega vence mañana a las 23:59.',
+    'Visita https://tienda.com/ofertas y https://tienda.com/descuentos.',
+    'Tu debes enviar la transferencia a la cuenta indicada.',
+    'Saludos cordiales, el equipo.',
+    '<img src="https://cdn.tienda.com/banner.png">',
+    'Quedo atento a sus comentarios, @maria.',
+]
+
+
+def generar_corpus(cantidad: int, semilla: int = 42) -> list:
+    """Corpus reproducible con mezcla de spam, notificaciones y correos reales."""
+    rnd = random.Random(semilla)
+    corpus = []
+    for i in range(cantidad):
+        n_frases = rnd.choice([0, 1, 3, 6, 12, 25])
+        corpus.append({
+            'id': f'msg{i}',
+            'de': rnd.choice(REMITENTES),
+            'asunto': rnd.choice(ASUNTOS),
+            'cuerpo': ' '.join(rnd.choice(FRASES) for _ in range(n_frases)),
+        })
+    return corpus
+
+
+# ================================================================
+# IMPLEMENTACIÓN ANTERIOR (referencia)
+# ================================================================
+
+def _es_spam_obvio_anterior(a: AnalizadorCorreos, correo: dict) -> bool:
+    remitente = correo.get('de', '').lower()
+    asunto = correo.get('asunto', '').lower()
+    cuerpo = correo.get('cuerpo', '')[:500].lower()
+    if any(palabra in remitente for palabra in a.dominios_spam):
+        return True
+    if any(palabra in asunto for palabra in a.palabras_spam):
+        return True
+    if len(cuerpo) < 50:
+        return True
+    if cuerpo.count('http') > 5:
+        return True
+    return False
+
+
+def _mencion_anterior(correo: dict, nombre_usuario: str = "") -> bool:
+    cuerpo = correo.get('cuerpo', '').lower()
+    if nombre_usuario and nombre_usuario.lower() in cuerpo:
+        return True
+    patrones_mencion = [
+        r'@\w+',
+        r'\btu\b.*\b(debes|necesitas|solicito|requiero)',
+        r'favor.*responder',
+        r'necesito.*que'
+    ]
+    for patron in patrones_mencion:
+        if re.search(patron, cuerpo):
+            return True
+    return False
+
+
+def _score_anterior(a: AnalizadorCorreos, correo: dict, nombre_usuario: str = "") -> int:
+    score = 0
+    asunto = correo.get('asunto', '').lower()
+    cuerpo = correo.get('cuerpo', '').lower()
+    for categoria, palabras in a.triggers_accion.items():
+        if any(palabra in asunto or palabra in cuerpo for palabra in palabras):
+            score += 30
+            break
+    if _mencion_anterior(correo, nombre_usuario):
+        score += 20
+    remitente = correo.get('de', '')
+    if any(ext in remitente for ext in ['.edu', '.gob', '.com.pe', 'company.com']):
+        score += 15
+    if 5 < len(asunto.split()) < 10:
+        score += 10
+    if '<img' not in cuerpo and len(cuerpo) < 2000:
+        score += 10
+    if 'unsubscribe' in cuerpo or 'darse de baja' in cuerpo:
+        score -= 20
+    return max(0, min(100, score))
+
+
+# ================================================================
+# BENCHMARKS
+# ================================================================
+
+def _cronometrar(funcion, repeticiones: int = 3) -> float:
+    """Mejor tiempo (segundos) de varias repeticiones."""
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def benchmark_capa1(corpus: list, nombre_usuario: str = "maria"):
+    a = AnalizadorCorreos()
+
+    def anterior():
+        return [
+            (_es_spam_obvio_anterior(a, c), _score_anterior(a, c, nombre_usuario))
+            for c in corpus
+        ]
+
+    def compilado():
+        resultados = []
+        for c in corpus:
+            senales = a.extraer_senales(c, nombre_usuario)
+            resultados.append((
+                a.es_spam_obvio(c, senales),
+                a.calcular_score_inicial(c, nombre_usuario, senales)
+            ))
+        return resultados
+
+    assert anterior() == compilado(), "❌ La Capa 1 compilada difiere de la anterior"
+
+    t_anterior = _cronometrar(anterior)
+    t_compilado = _cronometrar(compilado)
+    print(f"\n📊 CAPA 1 ({len(corpus)} correos)")
+    print(f"   Anterior (any/in + re.search): {t_anterior * 1000:8.1f} ms")
+    print(f"   Matcher compilado:             {t_compilado * 1000:8.1f} ms")
+    print(f"   Mejora: x{t_anterior / t_compilado:.2f}")
+
+
+if __name__ == "__main__":
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    corpus = generar_corpus(cantidad)
+    benchmark_capa1(corpus)
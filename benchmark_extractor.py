@@ -0,0 +1,200 @@
+"""
+MICROBENCHMARKS DEL EXTRACTOR DE CONTEXTO
+Ejecutar con: python benchmark_extractor.py [cantidad_alertas]
+
+Mide `enriquecer_alerta_con_contexto` y cada método del extractor con la
+instancia compartida (patrones compilados al importar) contra crear un
+`ExtractorContexto()` nuevo por alerta, como se hacía antes.
+"""
+import contextlib
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+from contexto_extractor import (
+    PROCESOS_EXTRACTOR, TIMEZONE, ExtractorContexto, _fecha_hora_memo, cerrar_pool_extractor,
+    enriquecer_alerta_con_contexto, obtener_extractor, tokenizar_temporal
+)
+from ner_contexto import entidades_lote, obtener_nlp
+from nomenclator_lugares import Nomenclator
+from tarea_rapida import construir_tarea_rapida
+
+
+# ================================================================
+# CORPUS SINTÉTICO
+# ================================================================
+
+ACCIONES = [
+    'Reunión con Juan Perez', 'Llamar a Ana Torres', 'Pon una alarma',
+    'Pagar la luz', 'Videollamada por zoom con el equipo', 'Cita en la Clínica Ricardo Palma',
+    'Mandar correo a rrhh@empresa.com.pe', 'Escribir por wsp a Carlos', 'Comprar pan'
+]
+
+CUANDO = [
+    'mañana a las 3 de la tarde', 'el lunes a las 10am', 'el 31 de enero del 2026 a las 17:00',
+    'el 15/02/2026', 'pasado mañana a las 6 de la mañana', 'hoy', 'el viernes a las 9', ''
+]
+
+DONDE = [
+    'en Miraflores Av. Larco 345', 'en Jockey Plaza', 'en San Isidro, Calle Las Begonias 441',
+    'al 987654321', 'al +51 987654321', 'por 2 horas', ''
+]
+
+
+def generar_alertas(cantidad: int, semilla: int = 7) -> list:
+    """Alertas reproducibles con mezcla de fechas, lugares, teléfonos y emails."""
+    rnd = random.Random(semilla)
+    return [
+        ' '.join(filter(None, [rnd.choice(ACCIONES), rnd.choice(CUANDO), rnd.choice(DONDE)]))
+        for _ in range(cantidad)
+    ]
+
+
+# ================================================================
+# BENCHMARKS
+# ================================================================
+
+def _cronometrar(funcion, repeticiones: int = 3) -> float:
+    """Mejor tiempo (segundos) de varias repeticiones (sin los prints del extractor)."""
+    mejor = float('inf')
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            funcion()
+            mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def benchmark_instancia(alertas: list):
+    def nueva_por_alerta():
+        for texto in alertas:
+            ExtractorContexto().extraer_todo(texto)
+
+    def compartida():
+        extractor = obtener_extractor()
+        for texto in alertas:
+            extractor.extraer_todo(texto)
+
+    t_nueva = _cronometrar(nueva_por_alerta)
+    t_compartida = _cronometrar(compartida)
+    print(f"\n📊 EXTRAER_TODO ({len(alertas)} alertas)")
+    print(f"   Instancia nueva por alerta: {t_nueva * 1e6 / len(alertas):8.1f} µs/alerta")
+    print(f"   Instancia compartida:       {t_compartida * 1e6 / len(alertas):8.1f} µs/alerta")
+    print(f"   Mejora: x{t_nueva / t_compartida:.2f}")
+
+
+def benchmark_metodos(alertas: list):
+    extractor = obtener_extractor()
+    referencia = datetime.now(TIMEZONE)
+    metodos = {
+        'extraer_fecha_hora': lambda t: extractor.extraer_fecha_hora(t, referencia),
+        'extraer_ubicacion': extractor.extraer_ubicacion,
+        'extraer_personas': extractor.extraer_personas,
+        'detectar_tipo_accion': extractor.detectar_tipo_accion,
+        'extraer_detalles': extractor.extraer_detalles,
+        'enriquecer_alerta': lambda t: enriquecer_alerta_con_contexto("Alerta", t),
+    }
+    print(f"\n📊 POR MÉTODO ({len(alertas)} alertas)")
+    for nombre, metodo in metodos.items():
+        t = _cronometrar(lambda: [metodo(texto) for texto in alertas])
+        print(f"   {nombre:<22} {t * 1e6 / len(alertas):8.1f} µs/alerta")
+
+
+def benchmark_fecha_hora(alertas: list):
+    extractor = obtener_extractor()
+    referencia = datetime.now(TIMEZONE)
+    textos = [texto.lower() for texto in alertas]
+
+    def sin_memo():
+        _fecha_hora_memo.cache_clear()
+        for texto in alertas:
+            extractor.extraer_fecha_hora(texto, referencia)
+
+    t_tokens = _cronometrar(lambda: [tokenizar_temporal(t) for t in textos])
+    t_sin_memo = _cronometrar(sin_memo)
+    t_memo = _cronometrar(lambda: [extractor.extraer_fecha_hora(t, referencia) for t in alertas])
+    print(f"\n📊 FECHA Y HORA ({len(alertas)} alertas, {len(set(alertas))} textos distintos)")
+    print(f"   Tokenizador (una pasada):     {t_tokens * 1e6 / len(alertas):8.1f} µs/alerta")
+    print(f"   extraer_fecha_hora (1ª vez):  {t_sin_memo * 1e6 / len(alertas):8.1f} µs/alerta")
+    print(f"   extraer_fecha_hora (memo):    {t_memo * 1e6 / len(alertas):8.1f} µs/alerta")
+
+
+def benchmark_nomenclator(alertas: list, lugares_extra: int = 5_000):
+    """Búsqueda de lugares: lista + `in` por lugar contra el trie, con una lista que crece."""
+    base = Nomenclator.desde_archivo()
+    nombres = [f"Lugar Sintetico {i}" for i in range(lugares_extra)]
+    grande = Nomenclator.desde_archivo()
+    for nombre in nombres:
+        grande.agregar(nombre, 'lugar')
+
+    def lista(cantidad_nombres):
+        lista_nombres = nombres[:cantidad_nombres]
+        return lambda: [[n for n in lista_nombres if n.lower() in t.lower()] for t in alertas]
+
+    print(f"\n📊 NOMENCLÁTOR ({len(alertas)} alertas)")
+    for etiqueta, nomenclator, cantidad in (('base', base, base.total), ('grande', grande, grande.total)):
+        t_lista = _cronometrar(lista(cantidad))
+        t_trie = _cronometrar(lambda: [nomenclator.buscar(t) for t in alertas])
+        print(f"   {cantidad:>6} lugares: lista + in {t_lista * 1e6 / len(alertas):8.1f} µs/alerta"
+              f" | trie {t_trie * 1e6 / len(alertas):6.1f} µs/alerta")
+
+
+def benchmark_lote(alertas: list):
+    extractor = obtener_extractor()
+    referencia = datetime.now(TIMEZONE)
+
+    def en_linea():
+        _fecha_hora_memo.cache_clear()
+        return [extractor.extraer_todo(texto, referencia) for texto in alertas]
+
+    def en_pool():
+        _fecha_hora_memo.cache_clear()
+        return extractor.extraer_lote(alertas, referencia, usar_ner=False)  # Mismo método que en_linea
+
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        assert en_linea() == en_pool(), "❌ extraer_lote difiere de extraer_todo"
+    t_linea = _cronometrar(en_linea)
+    t_pool = _cronometrar(en_pool)
+    cerrar_pool_extractor()
+    print(f"\n📊 EXTRAER_LOTE ({len(alertas)} alertas, {PROCESOS_EXTRACTOR} procesos)")
+    print(f"   Uno por uno:  {t_linea * 1000:8.1f} ms")
+    print(f"   extraer_lote: {t_pool * 1000:8.1f} ms")
+    print(f"   Mejora: x{t_linea / t_pool:.2f}")
+
+
+def benchmark_ner(alertas: list):
+    nlp = obtener_nlp()
+    if nlp is None:
+        print("\n⚠️ NER: spaCy o el modelo no están instalados, se omite")
+        return
+    t_uno = _cronometrar(lambda: [nlp(texto) for texto in alertas], repeticiones=1)
+    t_pipe = _cronometrar(lambda: entidades_lote(alertas), repeticiones=1)
+    print(f"\n📊 NER spaCy ({len(alertas)} alertas, {', '.join(nlp.pipe_names)})")
+    print(f"   nlp(texto) uno por uno: {t_uno * 1e6 / len(alertas):8.1f} µs/alerta")
+    print(f"   nlp.pipe por lotes:     {t_pipe * 1e6 / len(alertas):8.1f} µs/alerta")
+
+
+def benchmark_tarea_rapida(alertas: list):
+    """Cuántas alertas arma la ruta sin IA y cuánto tarda (Gemini tarda segundos)."""
+    ahora = datetime.now(TIMEZONE)
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        contextos = [enriquecer_alerta_con_contexto("Procesando...", texto) for texto in alertas]
+        armadas = sum(construir_tarea_rapida(t, c, ahora) is not None for t, c in zip(alertas, contextos))
+    t = _cronometrar(lambda: [construir_tarea_rapida(t, c, ahora) for t, c in zip(alertas, contextos)])
+    print(f"\n📊 TAREA RÁPIDA ({len(alertas)} alertas)")
+    print(f"   Armadas sin IA: {armadas} ({armadas * 100 / len(alertas):.1f}%)")
+    print(f"   construir_tarea_rapida: {t * 1e6 / len(alertas):8.1f} µs/alerta")
+
+
+if __name__ == "__main__":
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+    alertas = generar_alertas(cantidad)
+    benchmark_instancia(alertas)
+    benchmark_metodos(alertas)
+    benchmark_fecha_hora(alertas)
+    benchmark_nomenclator(alertas)
+    benchmark_lote(alertas)
+    benchmark_ner(alertas)
+    benchmark_tarea_rapida(alertas)
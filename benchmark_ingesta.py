@@ -0,0 +1,131 @@
+"""
+MICROBENCHMARKS DE LA INGESTA NEXUS (/nexus/sync/batch)
+Ejecutar con: python benchmark_ingesta.py [cantidad_mensajes]
+
+Arma el mismo batch sintético (determinista) en cada formato y compresión
+que acepta el endpoint, verifica que todos den EXACTAMENTE las mismas filas
+y compara tamaño del payload y tiempo de parseo por cada 10k mensajes
+contra la ruta anterior (gzip.decompress + json.loads + lista de filas).
+"""
+import asyncio
+import gzip
+import json
+import random
+import sys
+import time
+
+from ingesta_nexus import (
+    CAMPOS_MENSAJE, FORMATO_JSON, FORMATO_MSGPACK, FORMATO_NDJSON, MSGPACK_DISPONIBLE, ORJSON_DISPONIBLE,
+    ZSTD_DISPONIBLE, elementos_desde_stream, fila_mensaje
+)
+
+if MSGPACK_DISPONIBLE:
+    import msgpack
+if ZSTD_DISPONIBLE:
+    import zstandard
+
+TAMANO_CHUNK = 64 * 1024  # Lo que suele entregar el servidor por cada receive()
+POR_CADA = 10_000
+
+
+# ================================================================
+# BATCH SINTÉTICO
+# ================================================================
+
+CHATS = ['Mamá', 'Trabajo - Equipo Ventas', 'Juan Pérez', 'Grupo Promo 2015 🎓', 'Ana', 'Condominio Los Pinos']
+TEXTOS = [
+    'ok', 'Ya llegué', 'Mañana a las 3pm reunión en la oficina, no te olvides',
+    'Te yapeo los 50 soles en la noche 👍', '¿Dónde es la cita con el dentista?',
+    'Mandame el informe antes del viernes porfa, el jefe lo necesita para la junta del lunes',
+    'jajaja', '[Imagen]', 'Llámame cuando puedas al 987654321'
+]
+
+
+def generar_mensajes(cantidad: int, semilla: int = 11) -> list:
+    rnd = random.Random(semilla)
+    return [
+        {
+            'id': f'wa_{i:08d}',
+            'chatId': f'519{rnd.randint(10_000_000, 99_999_999)}@s.whatsapp.net',
+            'chatNombre': rnd.choice(CHATS),
+            'contenido': rnd.choice(TEXTOS),
+            'timestamp': 1_760_000_000_000 + i * 1_000,
+            'esMio': rnd.random() < 0.4,
+            'tipo': 'texto' if rnd.random() < 0.9 else 'imagen'
+        }
+        for i in range(cantidad)
+    ]
+
+
+def _compacto(msg: dict) -> list:
+    return [msg[campo] for campo in CAMPOS_MENSAJE]
+
+
+def codificar(mensajes: list) -> dict:
+    """{nombre: (formato, compresion, payload)} para todas las combinaciones disponibles."""
+    crudos = {
+        'json': (FORMATO_JSON, json.dumps(mensajes, ensure_ascii=False).encode()),
+        'ndjson': (FORMATO_NDJSON, ''.join(json.dumps(m, ensure_ascii=False) + '\n' for m in mensajes).encode()),
+    }
+    if MSGPACK_DISPONIBLE:
+        crudos['msgpack'] = (FORMATO_MSGPACK, b''.join(msgpack.packb(m) for m in mensajes))
+        crudos['msgpack compacto'] = (FORMATO_MSGPACK, b''.join(msgpack.packb(_compacto(m)) for m in mensajes))
+
+    payloads = {}
+    for nombre, (formato, datos) in crudos.items():
+        payloads[nombre] = (formato, None, datos)
+        payloads[f'{nombre} + gzip'] = (formato, 'gzip', gzip.compress(datos))
+        if ZSTD_DISPONIBLE:
+            payloads[f'{nombre} + zstd'] = (formato, 'zstd', zstandard.ZstdCompressor(level=3).compress(datos))
+    return payloads
+
+
+# ================================================================
+# BENCHMARKS
+# ================================================================
+
+async def _chunks(datos: bytes):
+    for i in range(0, len(datos), TAMANO_CHUNK):
+        yield datos[i:i + TAMANO_CHUNK]
+
+
+async def _filas_stream(formato: str, compresion, datos: bytes) -> list:
+    return [fila_mensaje(m, 'usuario', 'device') async for m in elementos_desde_stream(_chunks(datos), formato, compresion)]
+
+
+def _filas_anterior(datos: bytes) -> list:
+    return [fila_mensaje(m, 'usuario', 'device') for m in json.loads(gzip.decompress(datos))]
+
+
+def _cronometrar(funcion, repeticiones: int = 3) -> float:
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def benchmark_formatos(mensajes: list):
+    payloads = codificar(mensajes)
+    esperado = _filas_anterior(payloads['json + gzip'][2])
+    escala = POR_CADA / len(mensajes)
+
+    print(f"\n📊 INGESTA ({len(mensajes)} mensajes, valores por cada {POR_CADA:,} mensajes)")
+    print(f"   orjson: {'sí' if ORJSON_DISPONIBLE else 'no'} | msgpack: {'sí' if MSGPACK_DISPONIBLE else 'no'}"
+          f" | zstd: {'sí' if ZSTD_DISPONIBLE else 'no'}")
+    print(f"   {'formato':<26} {'payload':>10} {'parseo':>10}")
+
+    t_anterior = _cronometrar(lambda: _filas_anterior(payloads['json + gzip'][2]))
+    print(f"   {'anterior (json + gzip)':<26} {len(payloads['json + gzip'][2]) * escala / 1024:8.0f} KB"
+          f" {t_anterior * 1000 * escala:7.1f} ms")
+
+    for nombre, (formato, compresion, datos) in payloads.items():
+        assert asyncio.run(_filas_stream(formato, compresion, datos)) == esperado, f"❌ {nombre} da otras filas"
+        t = _cronometrar(lambda: asyncio.run(_filas_stream(formato, compresion, datos)))
+        print(f"   {nombre:<26} {len(datos) * escala / 1024:8.0f} KB {t * 1000 * escala:7.1f} ms")
+
+
+if __name__ == "__main__":
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else POR_CADA
+    benchmark_formatos(generar_mensajes(cantidad))
@@ -1,46 +1,165 @@
 """
 EXTRACTOR DE CONTEXTO PARA ACCIONES INTELIGENTES
 Analiza texto y extrae: fechas, lugares, personas, números, emails
+
+Todos los patrones se compilan UNA vez al importar el módulo y el extractor
+no guarda estado por llamada, así que se comparte una sola instancia
+(`obtener_extractor`) entre todos los hilos.
+Para muchos textos (backfills): `extraer_lote` / `enriquecer_alertas_lote`
+reparten el trabajo en un pool de procesos (el regex y dateutil no sueltan
+el GIL, los hilos no ayudan).
+Microbenchmarks: python benchmark_extractor.py
 """
 
+import multiprocessing
+import os
 import re
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 import pytz
 import phonenumbers
 from dateutil import parser as date_parser
 
+from ner_contexto import entidades_lote
+from nomenclator_lugares import obtener_nomenclator
+
 # Zona horaria por defecto (Perú)
 TIMEZONE = pytz.timezone('America/Lima')
 
+# ================================================================
+# PATRONES (compilados una sola vez)
+# ================================================================
+
+PATRONES_TELEFONO = [
+    r'\+?51\s?9\d{8}',  # Perú: +51 987654321
+    r'9\d{8}',          # Perú corto: 987654321
+    r'\d{3}[-.\s]?\d{3}[-.\s]?\d{3}',  # General
+]
+PATRON_EMAIL = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+
+# Palabras clave para tipo de acción (en orden de especificidad)
+KEYWORDS_ACCION = {
+    # 🔥 NUEVO: Prioridad a Alarmas
+    'alarma': ['despiértame', 'alarma', 'despertador', 'despertar', 'avísame a las', 'pon una alarma'],
+    'reunion_presencial': ['reunión', 'cita', 'junta', 'encuentro', 'visita', 'ir a'],
+    'videollamada': ['zoom', 'meet', 'teams', 'videollamada', 'video llamada', 'google meet', 'reunión virtual', 'entrevista virtual'],
+    'llamada': ['llamar', 'telefonear', 'contactar por teléfono'],
+    'whatsapp': ['whatsapp', 'escribir por wsp', 'mensaje wsp', 'mandar wsp'],
+    'email': ['email', 'correo', 'enviar mail', 'mandar correo'],
+    'pago': ['pagar', 'yapear', 'transferir', 'plin', 'depositar']
+}
+
+DIAS_SEMANA = {
+    'lunes': 0, 'martes': 1, 'miércoles': 2, 'miercoles': 2,
+    'jueves': 3, 'viernes': 4, 'sábado': 5, 'sabado': 5, 'domingo': 6
+}
+
+MESES_ES = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4,
+    'mayo': 5, 'junio': 6, 'julio': 7, 'agosto': 8,
+    'septiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12
+}
+
+# Respaldo si no se puede cargar el nomenclátor (lugares_lima.json)
+DISTRITOS_PERU = ['Miraflores', 'San Isidro', 'Surco', 'Santiago de Surco',
+                  'La Molina', 'Barranco', 'Jesús María', 'San Miguel',
+                  'Pueblo Libre', 'Magdalena', 'San Borja', 'Lince']
+
+LUGARES_CONOCIDOS = ['Larcomar', 'Jockey Plaza', 'Real Plaza', 'Open Plaza',
+                     'Clínica', 'Hospital', 'Universidad', 'Municipalidad',
+                     'Parque Kennedy', 'Ovalo Gutierrez', 'Estadio Nacional',
+                     'Clínica Ricardo Palma', 'Hospital Loayza', 'Hospital Rebagliati']
+
+_RE_TELEFONOS = [re.compile(p) for p in PATRONES_TELEFONO]
+# Tramos "numéricos" (dígitos con a lo más un separador entre ellos): toda
+# coincidencia de los patrones de teléfono cae dentro de uno, así que el
+# texto se recorre una sola vez y los patrones solo miran tramos de 9+ chars
+_RE_TRAMO_TELEFONO = re.compile(r'\+?\d(?:[-.\s]?\+?\d)*')
+LARGO_MIN_TELEFONO = 9
+MEMO_TELEFONOS = int(os.getenv('EXTRACTOR_MEMO_TELEFONOS', '4096'))
+_RE_EMAIL = re.compile(PATRON_EMAIL)
+_RE_NO_DIGITO = re.compile(r'\D')
+
+# ================================================================
+# TOKENIZADOR TEMPORAL (una sola pasada)
+# ================================================================
+# Cada alternativa va dentro de un lookahead: el escaneo no consume texto,
+# así que en una pasada aparecen TODAS las coincidencias de cada tipo (la
+# primera de cada tipo es la misma que daría su propio re.search). Las
+# alternativas son excluyentes en una misma posición.
+# "31 de enero del 2026" / "15 de enero", "31/01/2026", "5 de la tarde",
+# "17:00", "3pm", "a las 5", hoy/mañana y días de la semana.
+# El formato ISO (2026-01-31) no se tokeniza: queda para dateutil, como antes.
+_RE_TEMPORAL = re.compile(
+    # Filtro barato: solo se prueban las alternativas donde puede empezar un token
+    r'(?=[\dahjlmsvd])'
+    r'(?=(?:'
+    r'(?=\d)(?:'
+    r'(?P<fecha_texto>(?P<ft_dia>\d{1,2})\s+de\s+(?P<ft_mes>' + '|'.join(MESES_ES) + r')(?:\s+del?\s+(?P<ft_anio>\d{4}))?)'
+    r'|(?P<fecha_barra>(?P<fb_dia>\d{1,2})/(?P<fb_mes>\d{1,2})/(?P<fb_anio>\d{4}))'
+    r'|(?P<contextual>(?P<hc_num>\d{1,2})\s+de\s+la\s+(?P<hc_mod>mañana|tarde|noche))'
+    r'|(?P<h24>(?P<h24_num>\d{1,2}):(?P<h24_min>\d{2}))'
+    r'|(?P<ampm>(?P<ap_num>\d{1,2})\s*(?P<ap_per>am|pm))'
+    r')'
+    r'|(?P<simple>a\s+las?\s+(?P<hs_num>\d{1,2}))'
+    r'|(?P<relativo>hoy|mañana)'
+    r'|(?P<dia_semana>' + '|'.join(DIAS_SEMANA) + r')'
+    r'))'
+)
+
+# Grupos de valores de cada tipo de token
+_GRUPOS_TEMPORALES = {
+    'fecha_texto': ('ft_dia', 'ft_mes', 'ft_anio'),
+    'fecha_barra': ('fb_dia', 'fb_mes', 'fb_anio'),
+    'contextual': ('hc_num', 'hc_mod'),
+    'h24': ('h24_num', 'h24_min'),
+    'ampm': ('ap_num', 'ap_per'),
+    'simple': ('hs_num',),
+    'relativo': ('relativo',),
+    'dia_semana': ('dia_semana',),
+}
+
+# Lotes: desde cuántos textos conviene pagar el envío a otros procesos
+UMBRAL_LOTE_PROCESOS = int(os.getenv('EXTRACTOR_UMBRAL_PROCESOS', '200'))
+PROCESOS_EXTRACTOR = int(os.getenv('EXTRACTOR_PROCESOS', '0')) or (os.cpu_count() or 1)
+
+MEMO_FECHA_HORA = 2048  # textos distintos recordados por extraer_fecha_hora
+
+_RE_DIRECCIONES = [
+    # Patrón completo: Distrito + Número + Calle
+    re.compile(r'(en\s+)?([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+de\s+[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+)?)\s+(\d{1,5})\s+(Av\.|Avenida|Jr\.|Jirón|Calle|Ca\.|Psje\.|Pasaje)\s+([\w\s]+)', re.IGNORECASE),
+    # Patrón simple: Av/Jr/Calle + Nombre + Número
+    re.compile(r'(Av\.|Avenida|Jr\.|Jirón|Calle|Ca\.|Psje\.|Pasaje)\s+([\w\s]+?)\s+(\d{1,5})', re.IGNORECASE),
+    # Patrón con distrito al final
+    re.compile(r'(Av\.|Avenida|Jr\.|Jirón|Calle)\s+([\w\s]+)\d+[,\s]+(Miraflores|San Isidro|Surco|Santiago de Surco|La Molina|Barranco|Lima|Jesús María|Lince|San Miguel|Pueblo Libre|Magdalena|San Borja)', re.IGNORECASE),
+]
+
+_FIN_DE_FRASE = '.!?'
+_RE_NOMBRES = re.compile(r'\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+)+\b')
+_RE_DURACION = re.compile(r'(\d+)\s*(hora|horas|minuto|minutos|hr|hrs|min)')
+_RE_ALARMA = re.compile(r'alarma.*?(\d{1,2})\s+de\s+la\s+(mañana|tarde|noche)')
+_RE_ANTES_DE_MENSAJE = re.compile(r'^.*?(?=\[Mensaje\])', re.DOTALL)
+_HORA_POR_DEFECTO = datetime.strptime("09:00", "%H:%M").time()
+
+
 class ExtractorContexto:
     """
     Extrae información estructurada de texto natural para crear acciones contextuales.
+    Sin estado por llamada: usar la instancia compartida de `obtener_extractor()`.
     """
     
     def __init__(self):
-        # Patrones de extracción
-        self.patrones_telefono = [
-            r'\+?51\s?9\d{8}',  # Perú: +51 987654321
-            r'9\d{8}',          # Perú corto: 987654321
-            r'\d{3}[-.\s]?\d{3}[-.\s]?\d{3}',  # General
-        ]
-        
-        self.patrones_email = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+        # Patrones de extracción (los compilados viven a nivel de módulo)
+        self.patrones_telefono = PATRONES_TELEFONO
+        self.patrones_email = PATRON_EMAIL
         
         # Palabras clave para tipo de acción
-        self.keywords_accion = {
-            # 🔥 NUEVO: Prioridad a Alarmas
-            'alarma': ['despiértame', 'alarma', 'despertador', 'despertar', 'avísame a las', 'pon una alarma'],
-            'reunion_presencial': ['reunión', 'cita', 'junta', 'encuentro', 'visita', 'ir a'],
-            'videollamada': ['zoom', 'meet', 'teams', 'videollamada', 'video llamada', 'google meet', 'reunión virtual', 'entrevista virtual'],
-            'llamada': ['llamar', 'telefonear', 'contactar por teléfono'],
-            'whatsapp': ['whatsapp', 'escribir por wsp', 'mensaje wsp', 'mandar wsp'],
-            'email': ['email', 'correo', 'enviar mail', 'mandar correo'],
-            'pago': ['pagar', 'yapear', 'transferir', 'plin', 'depositar']
-        }
+        self.keywords_accion = KEYWORDS_ACCION
 
-    def extraer_todo(self, texto: str, fecha_referencia: datetime = None) -> Dict:
+    def extraer_todo(self, texto: str, fecha_referencia: datetime = None, entidades: Optional[Dict] = None) -> Dict:
         """
         Función principal que extrae TODOS los datos contextuales.
         
@@ -54,17 +173,39 @@ class ExtractorContexto:
         if not fecha_referencia:
             fecha_referencia = datetime.now(TIMEZONE)
         
+        fecha_hora = self.extraer_fecha_hora(texto, fecha_referencia)
+        entidades = entidades or {}
+        ubicacion = self.extraer_ubicacion(texto, entidades.get('lugares'))
+        personas = self.extraer_personas(texto, entidades.get('personas'))
+        tipo_accion = self.detectar_tipo_accion(texto)
+        
         return {
-            'fecha_hora': self.extraer_fecha_hora(texto, fecha_referencia),
-            'ubicacion': self.extraer_ubicacion(texto),
-            'personas': self.extraer_personas(texto),
-            'tipo_accion': self.detectar_tipo_accion(texto),
+            'fecha_hora': fecha_hora,
+            'ubicacion': ubicacion,
+            'personas': personas,
+            'tipo_accion': tipo_accion,
             'detalles': self.extraer_detalles(texto),
             'acciones_sugeridas': [],  # Se calcula después
             'mensaje_sugerido': None,   # Se genera con IA después
-            'completitud': self.calcular_completitud(texto)
+            # Con lo ya extraído (antes se volvía a extraer todo)
+            'completitud': self._puntos_completitud(texto, fecha_hora, ubicacion, personas, tipo_accion)
         }
 
+    def extraer_lote(self, textos: List[str], fecha_referencia: datetime = None, usar_ner: bool = True) -> List[Dict]:
+        """
+        `extraer_todo` para muchos textos, en el mismo orden. Personas y
+        lugares salen del NER de spaCy (`nlp.pipe` por lotes) si está
+        disponible. Lotes chicos se procesan aquí mismo; los grandes se
+        reparten en el pool de procesos.
+        """
+        if not fecha_referencia:
+            fecha_referencia = datetime.now(TIMEZONE)
+        entidades = (entidades_lote(textos) if usar_ner else None) or [None] * len(textos)
+        return _mapear_lote(
+            _extraer_todo_trabajador,
+            [(texto, fecha_referencia, ent) for texto, ent in zip(textos, entidades)]
+        )
+
     def extraer_fecha_hora(self, texto: str, ref: datetime) -> Optional[Dict]:
         """
         Extrae fechas y horas del texto usando lógica inteligente.
@@ -73,283 +214,79 @@ class ExtractorContexto:
         - "mañana a las 3pm" → 2026-01-15 15:00:00
         - "el viernes 10am" → próximo viernes a las 10:00
         - "15 de enero" → 2026-01-15 (sin hora)
-        """
-        usar_dateutil = len(texto) < 100  # Aumentado de 50 a 150
-        texto_lower = texto.lower()
-        resultado = {'fecha': None, 'hora': None, 'timestamp': None}
-        
-        # 1. DETECTAR REFERENCIAS RELATIVAS
-        if 'hoy' in texto_lower:
-            resultado['fecha'] = ref.date()
-        elif 'mañana' in texto_lower or 'mañana' in texto_lower:
-            resultado['fecha'] = (ref + timedelta(days=1)).date()
-        elif 'pasado mañana' in texto_lower:
-            resultado['fecha'] = (ref + timedelta(days=2)).date()
-        
-        # 2. DETECTAR DÍAS DE LA SEMANA
-        dias_semana = {
-            'lunes': 0, 'martes': 1, 'miércoles': 2, 'miercoles': 2,
-            'jueves': 3, 'viernes': 4, 'sábado': 5, 'sabado': 5, 'domingo': 6
-        }
-        
-        for dia_nombre, dia_num in dias_semana.items():
-            if dia_nombre in texto_lower:
-                dias_adelante = (dia_num - ref.weekday()) % 7
-                if dias_adelante == 0:
-                    dias_adelante = 7  # Si es el mismo día, asumimos la próxima semana
-                resultado['fecha'] = (ref + timedelta(days=dias_adelante)).date()
-                break
         
-        # 3. DETECTAR FECHAS EXACTAS (15/01, 15 de enero, etc.)
-        # 3. DETECTAR FECHAS EXACTAS (MEJORADO)
-        # Patrones específicos para fechas completas
-        patrones_fecha_completa = [
-            r'(\d{1,2})\s+de\s+(enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|octubre|noviembre|diciembre)\s+del?\s+(\d{4})',  # 31 de enero del 2026
-            r'(\d{1,2})/(\d{1,2})/(\d{4})',  # 31/01/2026
-            r'(\d{4})-(\d{1,2})-(\d{1,2})',  # 2026-01-31
-        ]
-
-        meses_es = {
-            'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4,
-            'mayo': 5, 'junio': 6, 'julio': 7, 'agosto': 8,
-            'septiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12
-        }
-
-        # Intentar con regex primero
-        for patron in patrones_fecha_completa:
-            match = re.search(patron, texto_lower)
-            if match:
-                try:
-                    if 'de' in patron:  # Formato: "31 de enero del 2026"
-                        dia = int(match.group(1))
-                        mes_nombre = match.group(2)
-                        año = int(match.group(3))
-                        mes = meses_es[mes_nombre]
-                        resultado['fecha'] = datetime(año, mes, dia).date()
-                        print(f"✅ Fecha detectada (formato texto): {resultado['fecha']}")
-                        break
-                    elif '/' in patron:  # Formato: "31/01/2026"
-                        dia = int(match.group(1))
-                        mes = int(match.group(2))
-                        año = int(match.group(3))
-                        resultado['fecha'] = datetime(año, mes, dia).date()
-                        print(f"✅ Fecha detectada (formato barra): {resultado['fecha']}")
-                        break
-                except Exception as e:
-                    print(f"⚠️ Error parseando fecha con regex: {e}")
-                    continue
-
-        # Si no se encontró con regex, intentar con dateutil
-        # Si no se encontró con regex, intentar con dateutil SOLO si el texto es corto
-        if not resultado['fecha']:
-            try:
-                # 🔥 CORRECCIÓN: Solo usar dateutil si el texto es menor a 50 caracteres
-                if len(texto) < 50:
-                    fecha_parseada = date_parser.parse(texto, fuzzy=True, default=ref)
-                    if fecha_parseada.date() != ref.date():
-                        resultado['fecha'] = fecha_parseada.date()
-                        print(f"✅ Fecha detectada (dateutil): {resultado['fecha']}")
-                else:
-                    print(f"⚠️ Texto muy largo para dateutil ({len(texto)} chars), usando solo regex")
-            except Exception as e:
-                print(f"⚠️ Error con dateutil: {e}")
-        
-        # 4. DETECTAR HORAS
-        # 4. DETECTAR HORAS (CORREGIDO - Prioridad a contexto)
-        patrones_hora = [
-            # 🔥 PRIORIDAD 1: "X de la tarde/mañana/noche" (MÁS ESPECÍFICO)
-            (r'(\d{1,2})\s+de\s+la\s+(mañana|tarde|noche)', 'contextual'),
-            (r'a\s+las?\s+(\d{1,2})\s+de\s+la\s+(mañana|tarde|noche)', 'contextual'),
-            # 🔥 ESTA ES LA LÍNEA QUE FALTA EN TU CÓDIGO ACTUAL:
-            (r'(\d{1,2}):(\d{2})\s*(am|pm)', 'ampm_colon'), 
-
-            
-            # PRIORIDAD 2: Formato 24h (ej: "17:00")
-            (r'(\d{1,2}):(\d{2})', '24h'),
-            
-            # PRIORIDAD 3: AM/PM
-            (r'(\d{1,2})\s*(am|pm)', 'ampm'),
-            
-            # PRIORIDAD 4: "a las X" sin contexto
-            (r'a\s+las?\s+(\d{1,2})', 'simple'),
-        ]
-
-        hora_detectada = None
-        modificador = None
-
-        for patron, tipo in patrones_hora:
-            match = re.search(patron, texto_lower)
-            if match:
-                try:
-                    grupos = match.groups()
-                    
-                    # CASO 1: "5 de la tarde" (CONTEXTO: mañana/tarde/noche)
-                    if tipo == 'contextual' and len(grupos) >= 2:
-                        hora_num = int(grupos[0])
-                        modificador = grupos[1]
-                        
-                        if modificador == 'tarde' and hora_num < 12:
-                            hora_num += 12  # "5 de la tarde" = 17:00
-                        elif modificador == 'noche' and hora_num < 12:
-                            hora_num += 12  # "8 de la noche" = 20:00
-                        # "mañana" no se modifica: "6 de la mañana" = 06:00
-                        
-                        hora_detectada = datetime.strptime(f"{hora_num}:00", "%H:%M").time()
-                        print(f"✅ Hora detectada: {hora_detectada} (de la {modificador})")
-                        break
-                    
-                    # CASO 2: Formato "17:00" (solo si NO se detectó contexto antes)
-                    elif tipo == '24h' and len(grupos) >= 2:
-                        hora_num = int(grupos[0])
-                        minutos = int(grupos[1])
-                        hora_detectada = datetime.strptime(f"{hora_num}:{minutos:02d}", "%H:%M").time()
-                        print(f"✅ Hora detectada: {hora_detectada} (formato 24h)")
-                        break
-                    
-                    # CASO 3: AM/PM
-                    elif tipo == 'ampm' and len(grupos) >= 2:
-                        hora_num = int(grupos[0])
-                        periodo = grupos[1]
-                        if periodo == 'pm' and hora_num < 12:
-                            hora_num += 12
-                        hora_detectada = datetime.strptime(f"{hora_num}:00", "%H:%M").time()
-                        print(f"✅ Hora detectada: {hora_detectada} ({periodo})")
-                        break
-                    
-                    # CASO 4: "a las 5" (inferir contexto)
-                    elif tipo == 'simple' and len(grupos) == 1:
-                        hora_num = int(grupos[0])
-                        # Heurística: 1-6 = tarde, 7-12 = mañana
-                        if 1 <= hora_num <= 6:
-                            hora_num += 12
-                        hora_detectada = datetime.strptime(f"{hora_num}:00", "%H:%M").time()
-                        print(f"✅ Hora detectada: {hora_detectada} (inferida)")
-                        break
-                        
-                except Exception as e:
-                    print(f"⚠️ Error parseando hora: {e}")
-                    continue
-
-        if hora_detectada:
-            resultado['hora'] = hora_detectada
-        
-        # 5. COMBINAR FECHA Y HORA EN TIMESTAMP
-        if resultado['fecha']:
-            if resultado['hora']:
-                resultado['timestamp'] = datetime.combine(
-                    resultado['fecha'], 
-                    resultado['hora']
-                ).replace(tzinfo=TIMEZONE).isoformat()
-            else:
-                # Si solo hay fecha, asignar 9am por defecto
-                resultado['timestamp'] = datetime.combine(
-                    resultado['fecha'],
-                    datetime.strptime("09:00", "%H:%M").time()
-                ).replace(tzinfo=TIMEZONE).isoformat()
-        
-        return resultado if resultado['fecha'] else None
+        El resultado solo depende del texto y de la FECHA de referencia, así
+        que se memoriza: volver a pedir el mismo texto el mismo día es gratis.
+        """
+        resultado = _fecha_hora_memo(texto, ref.date())
+        return dict(resultado) if resultado else None
 
-    def extraer_ubicacion(self, texto: str) -> Optional[Dict]:
+    def extraer_ubicacion(self, texto: str, lugares_ner: Optional[List[str]] = None) -> Optional[Dict]:
         """
         Extrae direcciones, lugares y nombres de establecimientos.
         MEJORADO: Captura direcciones completas incluyendo distrito.
+        `lugares_ner`: lugares (LOC) del NER, para lo que no está en el nomenclátor.
         """
         ubicacion = {'direccion': None, 'lugar_nombre': None}
         
         # 🔥 NUEVO: Patrones mejorados para Perú
-        patrones_direccion = [
-            # Patrón completo: Distrito + Número + Calle
-            r'(en\s+)?([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+de\s+[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+)?)\s+(\d{1,5})\s+(Av\.|Avenida|Jr\.|Jirón|Calle|Ca\.|Psje\.|Pasaje)\s+([\w\s]+)',
-            # Patrón simple: Av/Jr/Calle + Nombre + Número
-            r'(Av\.|Avenida|Jr\.|Jirón|Calle|Ca\.|Psje\.|Pasaje)\s+([\w\s]+?)\s+(\d{1,5})',
-            # Patrón con distrito al final
-            r'(Av\.|Avenida|Jr\.|Jirón|Calle)\s+([\w\s]+)\d+[,\s]+(Miraflores|San Isidro|Surco|Santiago de Surco|La Molina|Barranco|Lima|Jesús María|Lince|San Miguel|Pueblo Libre|Magdalena|San Borja)',
-        ]
-        
-        for patron in patrones_direccion:
-            match = re.search(patron, texto, re.IGNORECASE)
+        for patron in _RE_DIRECCIONES:
+            match = patron.search(texto)
             if match:
                 # Reconstruir dirección completa
                 grupos = [g for g in match.groups() if g and g.lower() not in ['en', 'a']]
                 ubicacion['direccion'] = ' '.join(grupos).strip()
                 break
         
-        # Si no encontró nada con patrones, buscar menciones de distritos
+        # Distritos y lugares conocidos: una sola pasada con el nomenclátor
+        lugares = obtener_nomenclator(DISTRITOS_PERU, LUGARES_CONOCIDOS).buscar(texto)
+        
+        # Si no encontró nada con patrones, usar la frase donde se menciona el distrito
         if not ubicacion['direccion']:
-            distritos_peru = ['Miraflores', 'San Isidro', 'Surco', 'Santiago de Surco', 
-                            'La Molina', 'Barranco', 'Jesús María', 'San Miguel',
-                            'Pueblo Libre', 'Magdalena', 'San Borja', 'Lince']
-            
-            for distrito in distritos_peru:
-                if distrito.lower() in texto.lower():
-                    # Buscar contexto alrededor del distrito
-                    patron_contexto = rf'([^.!?]*{distrito}[^.!?]*)'
-                    match_ctx = re.search(patron_contexto, texto, re.IGNORECASE)
-                    if match_ctx:
-                        ubicacion['direccion'] = match_ctx.group(1).strip()
-                        break
-        
-        # Detectar nombres de lugares conocidos
-        lugares_conocidos = ['Larcomar', 'Jockey Plaza', 'Real Plaza', 'Open Plaza',
-                            'Clínica', 'Hospital', 'Universidad', 'Municipalidad', 
-                            'Parque Kennedy', 'Ovalo Gutierrez', 'Estadio Nacional',
-                            'Clínica Ricardo Palma', 'Hospital Loayza', 'Hospital Rebagliati']
-        lugar_detectado = None
-        for lugar in lugares_conocidos:
-            if lugar.lower() in texto.lower():
-                ubicacion['lugar_nombre'] = lugar
-                # Si no hay dirección, usar el nombre del lugar
-                if not ubicacion['direccion']:
-                    ubicacion['direccion'] = lugar
-                break
+            distrito = next((l for l in lugares if l['tipo'] == 'distrito'), None)
+            if distrito:
+                ubicacion['direccion'] = _frase_alrededor(texto, distrito['inicio'], distrito['fin'])
+        
+        # Detectar nombres de lugares conocidos (el nombre normalizado del nomenclátor)
+        lugar = next((l for l in lugares if l['tipo'] != 'distrito'), None)
+        if lugar:
+            ubicacion['lugar_nombre'] = lugar['nombre']
+            # Si no hay dirección, usar el nombre del lugar
+            if not ubicacion['direccion']:
+                ubicacion['direccion'] = lugar['nombre']
+        elif lugares_ner:
+            ubicacion['lugar_nombre'] = lugares_ner[0]
+            if not ubicacion['direccion']:
+                ubicacion['direccion'] = lugares_ner[0]
         # Si NO hay lugar específico, verificar si hay dirección
-        if not ubicacion['direccion'] and not lugar_detectado:
+        if not ubicacion['direccion']:
             # NO devolver ubicación si solo menciona "hospital" genérico
             return None
 
-        if lugar_detectado:
-            ubicacion['lugar_nombre'] = lugar_detectado
-            if not ubicacion['direccion']:
-                ubicacion['direccion'] = lugar_detectado
-
-        return ubicacion if (ubicacion['direccion'] or ubicacion['lugar_nombre']) else None
+        return ubicacion
 
-    def extraer_personas(self, texto: str) -> List[Dict]:
+    def extraer_personas(self, texto: str, nombres: Optional[List[str]] = None) -> List[Dict]:
         """
         Extrae nombres de personas, teléfonos y emails.
+        `nombres`: personas (PER) del NER; si no trae ninguna se usa el regex.
         
         Returns:
             [{'nombre': str, 'telefono': str, 'email': str}]
         """
         personas = []
         
-        # 1. Extraer nombres (detectar mayúsculas consecutivas)
-        nombres_detectados = re.findall(r'\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+)+\b', texto)
-        
-        # 2. Extraer teléfonos
-        telefonos = []
-        for patron in self.patrones_telefono:
-            matches = re.findall(patron, texto)
-            telefonos.extend(matches)
+        # 1. Extraer nombres (NER o, si no hay, mayúsculas consecutivas)
+        nombres_detectados = nombres or _RE_NOMBRES.findall(texto)
         
-        # Validar y normalizar teléfonos
+        # 2. Extraer teléfonos (sin repetir) y normalizarlos a E.164
         telefonos_validos = []
-        for tel in telefonos:
-            try:
-                num_parseado = phonenumbers.parse(tel, "PE")
-                if phonenumbers.is_valid_number(num_parseado):
-                    telefonos_validos.append(phonenumbers.format_number(
-                        num_parseado, 
-                        phonenumbers.PhoneNumberFormat.E164
-                    ))
-            except:
-                # Si falla el parsing, intentar formato simple
-                tel_limpio = re.sub(r'\D', '', tel)
-                if len(tel_limpio) >= 9:
-                    telefonos_validos.append(f"+51{tel_limpio[-9:]}")
+        for tel in candidatos_telefono(texto):
+            normalizado = normalizar_telefono(tel)
+            if normalizado and normalizado not in telefonos_validos:
+                telefonos_validos.append(normalizado)
         
         # 3. Extraer emails
-        emails = re.findall(self.patrones_email, texto)
+        emails = _RE_EMAIL.findall(texto)
         
         # 4. Combinar información
         for i, nombre in enumerate(nombres_detectados):
@@ -396,8 +333,7 @@ class ExtractorContexto:
         }
         
         # Detectar duración
-        patron_duracion = r'(\d+)\s*(hora|horas|minuto|minutos|hr|hrs|min)'
-        match = re.search(patron_duracion, texto.lower())
+        match = _RE_DURACION.search(texto.lower())
         if match:
             cantidad = int(match.group(1))
             unidad = match.group(2)
@@ -414,20 +350,30 @@ class ExtractorContexto:
         Calcula qué tan completa está la información (0-10).
         Usado para el score de urgencia.
         """
+        return self._puntos_completitud(
+            texto,
+            self.extraer_fecha_hora(texto, datetime.now(TIMEZONE)),
+            self.extraer_ubicacion(texto),
+            self.extraer_personas(texto),
+            self.detectar_tipo_accion(texto)
+        )
+
+    @staticmethod
+    def _puntos_completitud(texto: str, fecha_hora, ubicacion, personas, tipo_accion: str) -> int:
         puntos = 0
         
         # +3 si tiene fecha
-        if self.extraer_fecha_hora(texto, datetime.now(TIMEZONE)):
+        if fecha_hora:
             puntos += 3
         
         # +3 si tiene ubicación O persona
-        if self.extraer_ubicacion(texto):
+        if ubicacion:
             puntos += 2
-        if self.extraer_personas(texto):
+        if personas:
             puntos += 2
         
         # +2 si tiene tipo de acción clara
-        if self.detectar_tipo_accion(texto) != 'tarea_general':
+        if tipo_accion != 'tarea_general':
             puntos += 2
         
         # +1 si tiene duración
@@ -478,12 +424,239 @@ class ExtractorContexto:
         return list(dict.fromkeys(acciones))[:4]
 
 
-def enriquecer_alerta_con_contexto(titulo: str, descripcion: str) -> Dict:
+# ================================================================
+# TELÉFONOS
+# ================================================================
+
+def candidatos_telefono(texto: str) -> List[str]:
+    """Números tal como aparecen en el texto, sin repetir (los patrones se solapan)."""
+    candidatos = {}
+    for tramo in _RE_TRAMO_TELEFONO.finditer(texto):
+        tramo = tramo.group()
+        if len(tramo) < LARGO_MIN_TELEFONO:
+            continue
+        for patron in _RE_TELEFONOS:
+            for tel in patron.findall(tramo):
+                candidatos[tel] = None
+    return list(candidatos)
+
+
+@lru_cache(maxsize=MEMO_TELEFONOS)
+def normalizar_telefono(tel: str) -> Optional[str]:
+    """
+    Número tal como aparece en el texto -> E.164 (None si no es válido).
+    Memorizado: los mismos contactos se repiten entre chats y correos, y
+    phonenumbers es lo más caro de extraer_personas.
+    """
+    try:
+        num_parseado = phonenumbers.parse(tel, "PE")
+        if phonenumbers.is_valid_number(num_parseado):
+            return phonenumbers.format_number(num_parseado, phonenumbers.PhoneNumberFormat.E164)
+    except Exception:
+        # Si falla el parsing, intentar formato simple
+        tel_limpio = _RE_NO_DIGITO.sub('', tel)
+        if len(tel_limpio) >= 9:
+            return f"+51{tel_limpio[-9:]}"
+    return None
+
+
+# ================================================================
+# FECHA Y HORA
+# ================================================================
+
+def tokenizar_temporal(texto_lower: str) -> List[Tuple[str, Tuple]]:
+    """
+    Todas las expresiones temporales del texto (ya en minúsculas), en orden
+    de aparición y en UNA pasada: [(tipo, valores), ...], p. ej.
+    "mañana a las 5 de la tarde" →
+        [('relativo', ('mañana',)), ('simple', ('5',)), ('contextual', ('5', 'tarde'))]
+    """
+    candidatos = []
+    for m in _RE_TEMPORAL.finditer(texto_lower):
+        tipo = next(t for t in _GRUPOS_TEMPORALES if m.group(t) is not None)
+        candidatos.append((tipo, tuple(m.group(g) for g in _GRUPOS_TEMPORALES[tipo])))
+    return candidatos
+
+
+def _fecha_texto(dia: str, mes_nombre: str, anio: Optional[str], fecha_ref: date) -> date:
+    mes = MESES_ES[mes_nombre]
+    if anio:
+        return date(int(anio), mes, int(dia))
+    # "15 de enero" sin año: la próxima vez que llegue esa fecha
+    fecha = date(fecha_ref.year, mes, int(dia))
+    return fecha if fecha >= fecha_ref else date(fecha_ref.year + 1, mes, int(dia))
+
+
+def _hora_desde_token(tipo: str, valores: Tuple) -> Optional[datetime]:
+    """Hora de un token (None si el tipo no es de hora). Lanza ValueError si es inválida."""
+    if tipo == 'contextual':  # "5 de la tarde"
+        hora_num, modificador = int(valores[0]), valores[1]
+        if modificador in ('tarde', 'noche') and hora_num < 12:
+            hora_num += 12  # "5 de la tarde" = 17:00, "8 de la noche" = 20:00
+        # "mañana" no se modifica: "6 de la mañana" = 06:00
+        return datetime.strptime(f"{hora_num}:00", "%H:%M").time()
+    if tipo == 'h24':  # "17:00"
+        return datetime.strptime(f"{int(valores[0])}:{int(valores[1]):02d}", "%H:%M").time()
+    if tipo == 'ampm':  # "3pm"
+        hora_num = int(valores[0])
+        if valores[1] == 'pm' and hora_num < 12:
+            hora_num += 12
+        return datetime.strptime(f"{hora_num}:00", "%H:%M").time()
+    if tipo == 'simple':  # "a las 5": 1-6 = tarde, 7-12 = mañana
+        hora_num = int(valores[0])
+        if 1 <= hora_num <= 6:
+            hora_num += 12
+        return datetime.strptime(f"{hora_num}:00", "%H:%M").time()
+    return None
+
+
+# Prioridad entre tokens: la primera fecha/hora válida de cada tipo, en este orden
+_PRIORIDAD_FECHA = ('fecha_texto', 'fecha_barra', 'fecha_dia_mes')
+_PRIORIDAD_HORA = ('contextual', 'h24', 'ampm', 'simple')
+
+
+@lru_cache(maxsize=MEMO_FECHA_HORA)
+def _fecha_hora_memo(texto: str, fecha_ref: date) -> Optional[Tuple]:
+    """
+    Fecha y hora de `texto` relativo a `fecha_ref` (resultado inmutable para
+    poder memorizarlo; `extraer_fecha_hora` lo devuelve como dict).
+    """
+    primeros: Dict[str, Tuple] = {}
+    relativos = set()
+    dias = set()
+    for tipo, valores in tokenizar_temporal(texto.lower()):
+        if tipo == 'relativo':
+            relativos.add(valores[0])
+        elif tipo == 'dia_semana':
+            dias.add(valores[0])
+        else:
+            if tipo == 'fecha_texto' and not valores[2]:
+                tipo = 'fecha_dia_mes'
+            primeros.setdefault(tipo, valores)
+
+    # 1. REFERENCIAS RELATIVAS ("pasado mañana" también contiene "mañana")
+    fecha = None
+    if 'hoy' in relativos:
+        fecha = fecha_ref
+    elif 'mañana' in relativos:
+        fecha = fecha_ref + timedelta(days=1)
+
+    # 2. DÍAS DE LA SEMANA (el primero de la semana que aparezca)
+    for dia_nombre, dia_num in DIAS_SEMANA.items():
+        if dia_nombre in dias:
+            dias_adelante = (dia_num - fecha_ref.weekday()) % 7
+            if dias_adelante == 0:
+                dias_adelante = 7  # Si es el mismo día, asumimos la próxima semana
+            fecha = fecha_ref + timedelta(days=dias_adelante)
+            break
+
+    # 3. FECHAS EXACTAS ("31 de enero del 2026", "31/01/2026", "15 de enero")
+    fecha_exacta = None
+    for tipo in _PRIORIDAD_FECHA:
+        valores = primeros.get(tipo)
+        if not valores:
+            continue
+        try:
+            if tipo == 'fecha_barra':
+                fecha_exacta = date(int(valores[2]), int(valores[1]), int(valores[0]))
+            else:
+                fecha_exacta = _fecha_texto(valores[0], valores[1], valores[2], fecha_ref)
+            print(f"✅ Fecha detectada ({tipo}): {fecha_exacta}")
+            break
+        except Exception as e:
+            print(f"⚠️ Error parseando fecha con regex: {e}")
+    if fecha_exacta:
+        fecha = fecha_exacta
+
+    # Si no hubo fecha, dateutil SOLO si el texto es corto (con textos largos inventa fechas)
+    if not fecha:
+        try:
+            if len(texto) < 50:
+                fecha_parseada = date_parser.parse(
+                    texto, fuzzy=True, default=datetime.combine(fecha_ref, _HORA_POR_DEFECTO)
+                )
+                if fecha_parseada.date() != fecha_ref:
+                    fecha = fecha_parseada.date()
+                    print(f"✅ Fecha detectada (dateutil): {fecha}")
+            else:
+                print(f"⚠️ Texto muy largo para dateutil ({len(texto)} chars), usando solo regex")
+        except Exception as e:
+            print(f"⚠️ Error con dateutil: {e}")
+
+    if not fecha:
+        return None
+
+    # 4. HORAS (prioridad al contexto: "5 de la tarde" antes que "a las 5")
+    hora = None
+    for tipo in _PRIORIDAD_HORA:
+        valores = primeros.get(tipo)
+        if not valores:
+            continue
+        try:
+            hora = _hora_desde_token(tipo, valores)
+            print(f"✅ Hora detectada: {hora} ({tipo})")
+            break
+        except Exception as e:
+            print(f"⚠️ Error parseando hora: {e}")
+
+    # 5. COMBINAR FECHA Y HORA EN TIMESTAMP (9am por defecto si solo hay fecha)
+    timestamp = datetime.combine(fecha, hora or _HORA_POR_DEFECTO).replace(tzinfo=TIMEZONE).isoformat()
+    return (('fecha', fecha), ('hora', hora), ('timestamp', timestamp))
+
+
+def _frase_alrededor(texto: str, inicio: int, fin: int) -> str:
+    """La frase (entre signos . ! ?) que contiene texto[inicio:fin]."""
+    desde = max(texto.rfind(signo, 0, inicio) for signo in _FIN_DE_FRASE) + 1
+    hasta = min((p for p in (texto.find(signo, fin) for signo in _FIN_DE_FRASE) if p >= 0), default=len(texto))
+    return texto[desde:hasta].strip()
+
+
+_extractor_compartido: Optional[ExtractorContexto] = None
+_candado_extractor = threading.Lock()
+
+
+def obtener_extractor() -> ExtractorContexto:
+    """Instancia única del extractor (se crea la primera vez, de forma segura entre hilos)."""
+    global _extractor_compartido
+    if _extractor_compartido is None:
+        with _candado_extractor:
+            if _extractor_compartido is None:
+                _extractor_compartido = ExtractorContexto()
+    return _extractor_compartido
+
+
+def _limpiar_texto_alerta(texto_sucio: str) -> str:
+    """Quita las instrucciones del sistema que vienen antes del mensaje real."""
+    # Si detectamos la etiqueta [Mensaje], usamos solo lo que sigue
+    if "[Mensaje]" in texto_sucio:
+        partes = texto_sucio.split("[Mensaje]")
+        if len(partes) > 1:
+            return partes[1].strip()
+    
+    # Si detectamos "Procesando..." o "[Instrucción]" pero sin tag de mensaje claro
+    elif "Procesando..." in texto_sucio or "[Instrucción]" in texto_sucio:
+        try:
+            return _RE_ANTES_DE_MENSAJE.sub('', texto_sucio)
+        except Exception:
+            return texto_sucio
+    return texto_sucio
+
+
+def enriquecer_alerta_con_contexto(
+    titulo: str,
+    descripcion: str,
+    entidades: Optional[Dict] = None,
+    fecha_referencia: Optional[datetime] = None
+) -> Dict:
     """
     Extrae automáticamente fecha, hora, ubicación y MÚLTIPLES acciones.
     VERSIÓN CORREGIDA: Filtra el texto antes de procesarlo.
+    `entidades`: personas/lugares del NER (los pasa `enriquecer_alertas_lote`).
+    `fecha_referencia`: "ahora" para las fechas relativas (default: ahora en Lima).
     """
-    extractor = ExtractorContexto()
+    extractor = obtener_extractor()
+    entidades = entidades or {}
+    ahora = fecha_referencia or datetime.now(TIMEZONE)
     
     # Texto original combinado
     texto_sucio = f"{titulo} {descripcion}"
@@ -491,21 +664,9 @@ def enriquecer_alerta_con_contexto(titulo: str, descripcion: str) -> Dict:
     # ========================================================
     # 🧹 LIMPIEZA DE TEXTO MEJORADA
     # ========================================================
-    texto_para_procesar = texto_sucio
-    
-    # Si detectamos la etiqueta [Mensaje], usamos solo lo que sigue
+    texto_para_procesar = _limpiar_texto_alerta(texto_sucio)
     if "[Mensaje]" in texto_sucio:
-        partes = texto_sucio.split("[Mensaje]")
-        if len(partes) > 1:
-            texto_para_procesar = partes[1].strip()
-            print("🧹 Texto limpiado: Se eliminaron las instrucciones del sistema.")
-    
-    # Si detectamos "Procesando..." o "[Instrucción]" pero sin tag de mensaje claro
-    elif "Procesando..." in texto_sucio or "[Instrucción]" in texto_sucio:
-        try:
-            texto_para_procesar = re.sub(r'^.*?(?=\[Mensaje\])', '', texto_sucio, flags=re.DOTALL)
-        except Exception:
-            texto_para_procesar = texto_sucio
+        print("🧹 Texto limpiado: Se eliminaron las instrucciones del sistema.")
     # 🔥 NUEVA CORRECCIÓN: Crear versión corta SOLO para el print
     if len(texto_para_procesar) > 100:
         texto_para_mostrar = texto_para_procesar[:100] + "..."
@@ -524,13 +685,13 @@ def enriquecer_alerta_con_contexto(titulo: str, descripcion: str) -> Dict:
     fecha_hora = None
     try:
         # Intentamos extraer con el texto limpio
-        fecha_hora = extractor.extraer_fecha_hora(texto_para_procesar, datetime.now(pytz.timezone('America/Lima'))) # Asumiendo tu TZ
+        fecha_hora = extractor.extraer_fecha_hora(texto_para_procesar, ahora)
     except Exception as e:
         print(f"⚠️ Error extrayendo fecha del texto limpio: {e}")
     # Fallback: Si falló o no trajo nada, intentar con el sucio (por seguridad)
     if not fecha_hora or not fecha_hora.get('fecha'):
         try:
-            fecha_hora = extractor.extraer_fecha_hora(texto_sucio, datetime.now(pytz.timezone('America/Lima')))
+            fecha_hora = extractor.extraer_fecha_hora(texto_sucio, ahora)
         except:
             print("⚠️ No se pudo extraer fecha por métodos tradicionales.")
     if fecha_hora and fecha_hora.get('fecha'):
@@ -545,8 +706,7 @@ def enriquecer_alerta_con_contexto(titulo: str, descripcion: str) -> Dict:
         try:
             # Patrón: "alarma a las 2 de la tarde"
             # Usamos el 're' global
-            patron_alarma = r'alarma.*?(\d{1,2})\s+de\s+la\s+(mañana|tarde|noche)'
-            match_alarma = re.search(patron_alarma, texto_lower)
+            match_alarma = _RE_ALARMA.search(texto_lower)
             
             if match_alarma:
                 hora_num = int(match_alarma.group(1))
@@ -570,12 +730,12 @@ def enriquecer_alerta_con_contexto(titulo: str, descripcion: str) -> Dict:
     # ========================================================
     # 3. EXTRAER UBICACIÓN
     # ========================================================
-    ubicacion = extractor.extraer_ubicacion(texto_para_procesar)
+    ubicacion = extractor.extraer_ubicacion(texto_para_procesar, entidades.get('lugares'))
     
     # ========================================================
     # 4. EXTRAER PERSONAS
     # ========================================================
-    personas = extractor.extraer_personas(texto_para_procesar)
+    personas = extractor.extraer_personas(texto_para_procesar, entidades.get('personas'))
     
     # ========================================================
     # 5. DETECCIÓN DE ACCIONES (Lógica sin cambios)
@@ -656,6 +816,90 @@ def _calcular_completitud(fecha_hora, ubicacion, personas):
     if ubicacion: puntos += 3
     if personas: puntos += 3
     return min(puntos, 10)
+
+
+# ================================================================
+# PROCESAMIENTO POR LOTES (pool de procesos)
+# ================================================================
+
+_pool_extractor: Optional[ProcessPoolExecutor] = None
+_candado_pool = threading.Lock()
+
+
+def _obtener_pool() -> ProcessPoolExecutor:
+    """Pool compartido, creado al primer lote grande. 'spawn': el proceso principal tiene hilos."""
+    global _pool_extractor
+    if _pool_extractor is None:
+        with _candado_pool:
+            if _pool_extractor is None:
+                _pool_extractor = ProcessPoolExecutor(
+                    max_workers=PROCESOS_EXTRACTOR,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+    return _pool_extractor
+
+
+def cerrar_pool_extractor():
+    global _pool_extractor
+    with _candado_pool:
+        if _pool_extractor is not None:
+            _pool_extractor.shutdown(wait=False, cancel_futures=True)
+            _pool_extractor = None
+
+
+def _extraer_todo_trabajador(argumentos):
+    texto, fecha_referencia, entidades = argumentos
+    return obtener_extractor().extraer_todo(texto, fecha_referencia, entidades)
+
+
+def _enriquecer_trabajador(argumentos):
+    titulo, descripcion, entidades, fecha_referencia = argumentos
+    return enriquecer_alerta_con_contexto(titulo, descripcion, entidades, fecha_referencia)
+
+
+def _mapear_lote(funcion, argumentos: List) -> List:
+    """`funcion` sobre cada elemento, en orden: en el pool si el lote es grande, si no aquí mismo."""
+    if len(argumentos) < UMBRAL_LOTE_PROCESOS or PROCESOS_EXTRACTOR < 2:
+        return [funcion(a) for a in argumentos]
+    try:
+        # Varios textos por envío para que el costo de serializar no se coma la ganancia
+        chunksize = max(1, len(argumentos) // (PROCESOS_EXTRACTOR * 4))
+        return list(_obtener_pool().map(funcion, argumentos, chunksize=chunksize))
+    except Exception as e:
+        print(f"⚠️ Pool del extractor falló ({e}), procesando en este proceso")
+        cerrar_pool_extractor()
+        return [funcion(a) for a in argumentos]
+
+
+def enriquecer_alertas_lote(
+    alertas: List[Tuple[str, str]],
+    usar_ner: bool = True,
+    fechas_referencia: Optional[List[Optional[datetime]]] = None
+) -> List[Dict]:
+    """
+    `enriquecer_alerta_con_contexto` para [(titulo, descripcion), ...], en el
+    mismo orden, con el NER de todo el lote en una sola pasada de `nlp.pipe`.
+    `fechas_referencia`: el "ahora" de cada alerta (p. ej. su created_at en un
+    backfill); None = ahora.
+
+    Con lotes grandes bloquea mientras trabaja el pool: desde código async
+    llamarla con `asyncio.to_thread`.
+    """
+    alertas = list(alertas)
+    entidades = None
+    if usar_ner and alertas:
+        entidades = entidades_lote([_limpiar_texto_alerta(f"{t} {d}") for t, d in alertas])
+    entidades = entidades or [None] * len(alertas)
+    fechas_referencia = fechas_referencia or [None] * len(alertas)
+    return _mapear_lote(
+        _enriquecer_trabajador,
+        [
+            (titulo, descripcion, ent, fecha)
+            for (titulo, descripcion), ent, fecha in zip(alertas, entidades, fechas_referencia)
+        ]
+    )
+
+
 # ========================================================
 # TESTS (ejecutar con: python contexto_extractor.py)
 # ========================================================
@@ -671,7 +915,7 @@ if __name__ == "__main__":
         "Escribir por WhatsApp a Pedro sobre el proyecto"
     ]
     
-    extractor = ExtractorContexto()
+    extractor = obtener_extractor()
     
     for i, texto in enumerate(tests, 1):
         print(f"\n{'='*60}")
@@ -8,7 +8,7 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from email.mime.text import MIMEText
 import base64
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional
 import re
 from datetime import datetime
 
@@ -83,6 +83,82 @@ class GmailService:
             print(f'Error obteniendo correos: {error}')
             return []
     
+    def listar_no_leidos(self, cantidad: int = 50) -> List[Dict]:
+        """
+        Solo ids de los no leídos (una llamada, sin descargar cuerpos).
+        
+        Returns:
+            [{'id': str, 'threadId': str}]
+        """
+        try:
+            resultados = self.service.users().messages().list(
+                userId='me',
+                q='is:unread',
+                maxResults=cantidad
+            ).execute()
+            return resultados.get('messages', [])
+        
+        except HttpError as error:
+            print(f'Error obteniendo correos: {error}')
+            return []
+    
+    def obtener_mensaje(self, mensaje_id: str) -> Optional[Dict]:
+        """Descarga y parsea un mensaje (None si falla)."""
+        try:
+            msg_detail = self.service.users().messages().get(
+                userId='me',
+                id=mensaje_id,
+                format='full'
+            ).execute()
+            return self._parsear_mensaje(msg_detail)
+        
+        except HttpError as e:
+            print(f"Error obteniendo mensaje {mensaje_id}: {e}")
+            return None
+    
+    def iterar_hilos(self, referencias: List[Dict]) -> Iterator[List[Dict]]:
+        """
+        Generador: descarga los mensajes HILO POR HILO y entrega cada hilo
+        apenas está completo, para que el análisis empiece sin esperar al
+        resto de la bandeja.
+        
+        Args:
+            referencias: Resultado de listar_no_leidos() (ya sin duplicados)
+        """
+        hilos: Dict[str, List[str]] = {}
+        for ref in referencias:
+            hilos.setdefault(ref.get('threadId') or ref['id'], []).append(ref['id'])
+        
+        for ids in hilos.values():
+            mensajes = [m for m in (self.obtener_mensaje(i) for i in ids) if m]
+            if mensajes:
+                yield mensajes
+    
+    def listar_todos(self, cantidad: int = 500) -> List[Dict]:
+        """
+        Ids de TODOS los correos (leídos y no leídos), sin descargar cuerpos.
+        
+        Returns:
+            [{'id': str, 'threadId': str}]
+        """
+        try:
+            resultados = self.service.users().messages().list(
+                userId='me',
+                maxResults=cantidad
+            ).execute()
+            return resultados.get('messages', [])
+        
+        except HttpError as error:
+            print(f'Error obteniendo correos: {error}')
+            return []
+    
+    def clonar(self) -> 'GmailService':
+        """
+        Otra instancia con el mismo token. El cliente HTTP de la API no es
+        thread-safe: cada hilo que descarga en paralelo usa su propio clon.
+        """
+        return GmailService(access_token=self.credentials.token)
+    
     def obtener_correos_todos(self, cantidad: int = 500) -> List[Dict]:
         """
         Obtiene TODOS los correos (leídos y no leídos) para análisis histórico.
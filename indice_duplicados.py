@@ -0,0 +1,177 @@
+"""
+ÍNDICE DE CASI-DUPLICADOS (SimHash + LSH por bandas)
+Newsletters y avisos automáticos llegan en copias casi idénticas días tras día
+y en varias cuentas. Si un correo se parece lo suficiente a otro que Gemini ya
+clasificó para el mismo usuario, heredamos esa clasificación y nos ahorramos la
+llamada de la Capa 2.
+
+Persistencia (Supabase), tabla `huellas_correos`:
+    usuario_id, huella (hex de 64 bits), dominio, clasificacion (jsonb), creado_en
+"""
+import hashlib
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pytz
+
+BITS_HUELLA = 64
+BANDAS_LSH = 4            # 4 bandas de 16 bits: distancia <= 3 siempre comparte al menos una
+DISTANCIA_MAXIMA = 3      # bits distintos tolerados para considerar "el mismo correo"
+MIN_PALABRAS_HUELLA = 8   # textos más cortos no son confiables para comparar
+TAMANO_SHINGLE = 3
+LIMITE_HUELLAS_USUARIO = 5000
+
+_RE_HTML = re.compile(r'<[^>]+>')
+_RE_URL = re.compile(r'https?://\S+|www\.\S+')
+_RE_DIGITOS = re.compile(r'\d+')
+_RE_PALABRA = re.compile(r'\w+')
+
+
+def normalizar_texto(asunto: str, cuerpo: str) -> List[str]:
+    """
+    Palabras del asunto + cuerpo sin lo que cambia entre copias de un mismo
+    envío masivo: HTML, URLs con tracking, números (fechas, montos, códigos).
+    """
+    texto = f"{asunto or ''} {cuerpo or ''}".lower()
+    texto = _RE_HTML.sub(' ', texto)
+    texto = _RE_URL.sub(' ', texto)
+    texto = _RE_DIGITOS.sub('0', texto)
+    return _RE_PALABRA.findall(texto)
+
+
+def calcular_simhash(palabras: List[str]) -> int:
+    """SimHash de 64 bits sobre shingles de palabras."""
+    if len(palabras) < TAMANO_SHINGLE:
+        shingles = [' '.join(palabras)]
+    else:
+        shingles = [
+            ' '.join(palabras[i:i + TAMANO_SHINGLE])
+            for i in range(len(palabras) - TAMANO_SHINGLE + 1)
+        ]
+
+    pesos = [0] * BITS_HUELLA
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(BITS_HUELLA):
+            pesos[bit] += 1 if (h >> bit) & 1 else -1
+
+    huella = 0
+    for bit, peso in enumerate(pesos):
+        if peso > 0:
+            huella |= 1 << bit
+    return huella
+
+
+def huella_correo(correo: Dict) -> Optional[int]:
+    """Huella del correo, o None si es demasiado corto para compararlo."""
+    palabras = normalizar_texto(correo.get('asunto', ''), correo.get('cuerpo', ''))
+    if len(palabras) < MIN_PALABRAS_HUELLA:
+        return None
+    return calcular_simhash(palabras)
+
+
+def _dominio(remitente: str) -> str:
+    return remitente.split('@')[-1].lower() if remitente else ''
+
+
+class IndiceDuplicados:
+    """
+    Índice en memoria de huellas ya clasificadas de UN usuario.
+
+    Cada huella se parte en BANDAS_LSH bandas; dos huellas a distancia
+    <= DISTANCIA_MAXIMA coinciden exactamente en al menos una banda, así que
+    solo se compara contra los candidatos de esas cubetas.
+    """
+
+    def __init__(self, usuario_id: str):
+        self.usuario_id = usuario_id
+        self.entradas: List[Dict] = []
+        self.cubetas: Dict[tuple, List[int]] = {}
+        self.pendientes: List[Dict] = []  # nuevas, aún sin guardar en Supabase
+
+    def _bandas(self, huella: int) -> List[tuple]:
+        ancho = BITS_HUELLA // BANDAS_LSH
+        mascara = (1 << ancho) - 1
+        return [(i, (huella >> (i * ancho)) & mascara) for i in range(BANDAS_LSH)]
+
+    def agregar(self, huella: int, dominio: str, clasificacion: Dict, nueva: bool = True):
+        entrada = {'huella': huella, 'dominio': dominio, 'clasificacion': clasificacion}
+        posicion = len(self.entradas)
+        self.entradas.append(entrada)
+        for banda in self._bandas(huella):
+            self.cubetas.setdefault(banda, []).append(posicion)
+        if nueva:
+            self.pendientes.append(entrada)
+
+    def buscar(self, huella: int, dominio: str) -> Optional[Dict]:
+        """Clasificación del casi-duplicado más cercano del mismo dominio (o None)."""
+        mejor = None
+        mejor_distancia = DISTANCIA_MAXIMA + 1
+        vistos = set()
+        for banda in self._bandas(huella):
+            for posicion in self.cubetas.get(banda, []):
+                if posicion in vistos:
+                    continue
+                vistos.add(posicion)
+                entrada = self.entradas[posicion]
+                if entrada['dominio'] != dominio:
+                    continue
+                distancia = bin(huella ^ entrada['huella']).count('1')
+                if distancia < mejor_distancia:
+                    mejor, mejor_distancia = entrada, distancia
+        return mejor['clasificacion'] if mejor else None
+
+    def buscar_correo(self, correo: Dict, huella: Optional[int] = None) -> Optional[Dict]:
+        huella = huella if huella is not None else huella_correo(correo)
+        if huella is None:
+            return None
+        return self.buscar(huella, _dominio(correo.get('de', '')))
+
+    def guardar_pendientes(self, supabase_client) -> int:
+        """Inserta en un solo viaje las huellas nuevas. Devuelve cuántas se guardaron."""
+        if not self.pendientes:
+            return 0
+        ahora = datetime.now(pytz.utc).isoformat()
+        filas = [
+            {
+                'usuario_id': self.usuario_id,
+                'huella': format(e['huella'], '016x'),
+                'dominio': e['dominio'],
+                'clasificacion': e['clasificacion'],
+                'creado_en': ahora
+            }
+            for e in self.pendientes
+        ]
+        try:
+            supabase_client.table('huellas_correos').insert(filas).execute()
+            self.pendientes = []
+            return len(filas)
+        except Exception as e:
+            print(f"⚠️ No se pudieron guardar huellas de duplicados: {e}")
+            return 0
+
+
+def cargar_indice_duplicados(
+    supabase_client,
+    usuario_id: str,
+    limite: int = LIMITE_HUELLAS_USUARIO
+) -> IndiceDuplicados:
+    """Índice del usuario con sus huellas más recientes (vacío si la tabla falla)."""
+    indice = IndiceDuplicados(usuario_id)
+    try:
+        res = supabase_client.table('huellas_correos')\
+            .select('huella, dominio, clasificacion')\
+            .eq('usuario_id', usuario_id)\
+            .order('creado_en', desc=True)\
+            .limit(limite)\
+            .execute()
+        for fila in res.data or []:
+            try:
+                indice.agregar(int(fila['huella'], 16), fila.get('dominio') or '',
+                               fila['clasificacion'], nueva=False)
+            except (KeyError, TypeError, ValueError):
+                continue
+    except Exception as e:
+        print(f"⚠️ No se pudo cargar el índice de duplicados: {e}")
+    return indice
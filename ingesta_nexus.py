@@ -0,0 +1,334 @@
+"""
+INGESTA EN STREAMING PARA /nexus/sync/batch
+El teléfono puede mandar un backlog enorme de mensajes. En vez de leer todo
+el body, descomprimirlo entero, hacer `json.loads` del array completo y
+armar otra lista igual de grande, aquí cada chunk que llega:
+  1. se descomprime de a poco (gzip o zstd, sin tener todo el archivo),
+  2. se parsea mensaje por mensaje según el formato del body,
+y las filas se guardan en lotes de tamaño fijo. La memoria depende del
+tamaño del lote y del chunk, no de cuántos mensajes traiga el batch.
+
+Formatos (Content-Type):
+  - application/json       -> array JSON `[{...}, {...}]` (lo que manda hoy la app)
+  - application/x-ndjson   -> un mensaje JSON por línea
+  - application/msgpack    -> mensajes MessagePack concatenados (sin array que los envuelva)
+Compresión (Content-Encoding): gzip, zstd o ninguna.
+
+Cada mensaje puede venir como objeto con las claves de siempre (`chatId`,
+`chatNombre`, `esMio`...) o en forma compacta, como lista en el orden de
+CAMPOS_MENSAJE: `["id", "chatId", "chatNombre", "contenido", ts, esMio, "tipo"]`.
+"""
+import codecs
+import json
+import os
+import re
+import zlib
+from typing import AsyncIterable, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+    ORJSON_DISPONIBLE = True
+except ImportError:
+    ORJSON_DISPONIBLE = False
+
+try:
+    import msgpack
+    MSGPACK_DISPONIBLE = True
+except ImportError:
+    MSGPACK_DISPONIBLE = False
+
+try:
+    import zstandard
+    ZSTD_DISPONIBLE = True
+except ImportError:
+    ZSTD_DISPONIBLE = False
+
+TAMANO_LOTE_UPSERT = int(os.getenv('NEXUS_UPSERT_LOTE', '500'))
+TAMANO_PEDAZO_GZIP = 256 * 1024
+MAX_BUFFER_JSON = 1024 * 1024  # Un solo mensaje no debería pasar de 1 MB de texto
+
+# Formatos y compresiones aceptados (Content-Type / Content-Encoding -> nombre interno)
+FORMATO_JSON = 'json'
+FORMATO_NDJSON = 'ndjson'
+FORMATO_MSGPACK = 'msgpack'
+TIPOS_CONTENIDO = {
+    'application/json': FORMATO_JSON,
+    'application/x-ndjson': FORMATO_NDJSON,
+    'application/ndjson': FORMATO_NDJSON,
+    'application/jsonl': FORMATO_NDJSON,
+    'application/msgpack': FORMATO_MSGPACK,
+    'application/x-msgpack': FORMATO_MSGPACK,
+    'application/vnd.msgpack': FORMATO_MSGPACK,
+}
+COMPRESIONES = {'gzip', 'zstd', 'identity'}
+
+# Orden de los campos en la forma compacta (mensaje como lista)
+CAMPOS_MENSAJE = ('id', 'chatId', 'chatNombre', 'contenido', 'timestamp', 'esMio', 'tipo')
+
+_RE_ESPACIOS = re.compile(r'[ \t\r\n]*')
+_json_loads = orjson.loads if ORJSON_DISPONIBLE else json.loads
+
+
+class ErrorIngesta(ValueError):
+    """Body corrupto: compresión inválida o mensajes mal formados."""
+
+
+class FormatoNoSoportado(ErrorIngesta):
+    """Content-Encoding desconocido o formato sin su librería instalada."""
+
+
+def negociar_formato(content_type: Optional[str], content_encoding: Optional[str]) -> Tuple[str, Optional[str]]:
+    """
+    ('json' | 'ndjson' | 'msgpack', 'gzip' | 'zstd' | None) según los headers.
+    Sin Content-Type (o con uno desconocido) se asume JSON, como se aceptaba
+    siempre; una compresión desconocida sí es error.
+    """
+    tipo = (content_type or 'application/json').split(';')[0].strip().lower()
+    formato = TIPOS_CONTENIDO.get(tipo, FORMATO_JSON)
+    if formato == FORMATO_MSGPACK and not MSGPACK_DISPONIBLE:
+        raise FormatoNoSoportado("MessagePack no disponible en el servidor (falta msgpack)")
+
+    compresion = (content_encoding or 'identity').strip().lower()
+    if compresion not in COMPRESIONES:
+        raise FormatoNoSoportado(f"Content-Encoding no soportado: {compresion}")
+    if compresion == 'zstd' and not ZSTD_DISPONIBLE:
+        raise FormatoNoSoportado("zstd no disponible en el servidor (falta zstandard)")
+    return formato, (None if compresion == 'identity' else compresion)
+
+
+# ================================================================
+# DESCOMPRESIÓN
+# ================================================================
+
+class DescompresorGzip:
+    """
+    gzip por chunks (acepta varios miembros gzip concatenados). Entrega la
+    salida en pedazos de a lo más TAMANO_PEDAZO_GZIP: un chunk muy
+    comprimido no se infla entero en memoria.
+    """
+
+    def __init__(self):
+        self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def alimentar(self, datos: bytes) -> Iterator[bytes]:
+        try:
+            while datos:
+                pedazo = self._zlib.decompress(datos, TAMANO_PEDAZO_GZIP)
+                if pedazo:
+                    yield pedazo
+                if self._zlib.unconsumed_tail:
+                    datos = self._zlib.unconsumed_tail
+                elif self._zlib.eof and self._zlib.unused_data:
+                    datos = self._zlib.unused_data  # Empieza otro miembro gzip
+                    self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                else:
+                    datos = b''
+        except zlib.error as e:
+            raise ErrorIngesta(f"gzip inválido: {e}")
+
+    def terminar(self) -> bytes:
+        if not self._zlib.eof:
+            raise ErrorIngesta("gzip incompleto (se cortó la subida)")
+        return self._zlib.flush()
+
+
+class DescompresorZstd:
+    """zstd por chunks (acepta varios frames concatenados), misma interfaz que DescompresorGzip."""
+
+    def __init__(self):
+        self._dctx = zstandard.ZstdDecompressor()
+        self._zstd = self._dctx.decompressobj()
+
+    def alimentar(self, datos: bytes) -> Iterator[bytes]:
+        try:
+            while datos:
+                if self._zstd.eof:  # El frame anterior terminó justo al final del chunk
+                    self._zstd = self._dctx.decompressobj()
+                pedazo = self._zstd.decompress(datos)
+                if pedazo:
+                    yield pedazo
+                datos = self._zstd.unused_data if self._zstd.eof else b''
+        except zstandard.ZstdError as e:
+            raise ErrorIngesta(f"zstd inválido: {e}")
+
+    def terminar(self) -> bytes:
+        if not self._zstd.eof:
+            raise ErrorIngesta("zstd incompleto (se cortó la subida)")
+        return b''
+
+
+# ================================================================
+# LECTORES (bytes -> mensajes)
+# ================================================================
+
+class LectorArrayJSON:
+    """
+    Parser incremental de `[{...}, {...}, ...]`: se le pasan bytes a medida
+    que llegan y devuelve los elementos que ya están completos.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._abierto = False
+        self._cerrado = False
+        self._espera_separador = False  # Después de un elemento solo vale ',' o ']'
+        self._despues_de_coma = False   # Después de ',' solo vale otro elemento
+
+    def alimentar(self, datos: bytes, final: bool = False) -> List:
+        try:
+            texto = self._utf8.decode(datos, final)
+        except UnicodeDecodeError as e:
+            raise ErrorIngesta(f"UTF-8 inválido: {e}")
+        self._buffer = self._buffer[self._pos:] + texto
+        self._pos = 0
+        elementos = []
+        while True:
+            pos = self._saltar(self._pos)
+            if pos >= len(self._buffer):
+                break
+            if self._cerrado:
+                raise ErrorIngesta("hay datos después del cierre del array")
+            if not self._abierto:
+                if self._buffer[pos] != '[':
+                    raise ErrorIngesta("se esperaba un array JSON")
+                self._abierto = True
+                self._pos = pos + 1
+                continue
+            caracter = self._buffer[pos]
+            if self._espera_separador:
+                if caracter not in ',]':
+                    raise ErrorIngesta("se esperaba ',' o ']' después de un elemento")
+                self._espera_separador = False
+                self._despues_de_coma = caracter == ','
+                self._cerrado = caracter == ']'
+                self._pos = pos + 1
+                continue
+            if caracter in ',]':
+                if caracter == ',' or self._despues_de_coma:
+                    raise ErrorIngesta(f"'{caracter}' sin un elemento antes")
+                self._cerrado = True
+                self._pos = pos + 1
+                continue
+            try:
+                elemento, fin = self._decoder.raw_decode(self._buffer, pos)
+            except json.JSONDecodeError as e:
+                if final:
+                    raise ErrorIngesta(f"JSON inválido: {e}")
+                break  # Elemento incompleto: esperar el siguiente chunk
+            if fin == len(self._buffer) and not final:
+                break  # Un número/literal al final podría seguir en el próximo chunk
+            elementos.append(elemento)
+            self._pos = fin
+            self._espera_separador = True
+            self._despues_de_coma = False
+
+        if len(self._buffer) - self._pos > MAX_BUFFER_JSON:
+            raise ErrorIngesta("elemento del array demasiado grande")
+        if final and not self._cerrado:
+            raise ErrorIngesta("el array JSON no está cerrado")
+        return elementos
+
+    def _saltar(self, pos: int) -> int:
+        return _RE_ESPACIOS.match(self._buffer, pos).end()
+
+
+class LectorNDJSON:
+    """Un mensaje JSON por línea (orjson si está instalado). Las líneas vacías se ignoran."""
+
+    def __init__(self):
+        self._resto = b''
+
+    def alimentar(self, datos: bytes, final: bool = False) -> List:
+        lineas = (self._resto + datos).split(b'\n')
+        self._resto = b'' if final else lineas.pop()
+        if len(self._resto) > MAX_BUFFER_JSON:
+            raise ErrorIngesta("línea NDJSON demasiado grande")
+        try:
+            return [_json_loads(linea) for linea in lineas if linea.strip()]
+        except ValueError as e:  # JSONDecodeError (json y orjson) y UTF-8 inválido
+            raise ErrorIngesta(f"NDJSON inválido: {e}")
+
+
+class LectorMsgpack:
+    """Mensajes MessagePack concatenados, decodificados con el Unpacker en streaming."""
+
+    def __init__(self):
+        self._unpacker = msgpack.Unpacker(raw=False, max_buffer_size=2 * MAX_BUFFER_JSON + TAMANO_PEDAZO_GZIP)
+        self._recibidos = 0
+        self._fin_ultimo = 0  # tell() cuenta también lo ya parseado de un objeto a medias
+
+    def alimentar(self, datos: bytes, final: bool = False) -> List:
+        elementos = []
+        try:
+            if datos:
+                self._unpacker.feed(datos)
+                self._recibidos += len(datos)
+            for elemento in self._unpacker:
+                elementos.append(elemento)
+                self._fin_ultimo = self._unpacker.tell()
+        except msgpack.BufferFull:
+            raise ErrorIngesta("mensaje MessagePack demasiado grande")
+        except (ValueError, msgpack.UnpackException) as e:  # ExtraData, FormatError, StackError, UTF-8
+            raise ErrorIngesta(f"MessagePack inválido: {e!r}")
+        if final and self._fin_ultimo != self._recibidos:
+            raise ErrorIngesta("MessagePack incompleto (se cortó la subida)")
+        return elementos
+
+
+_LECTORES = {FORMATO_JSON: LectorArrayJSON, FORMATO_NDJSON: LectorNDJSON, FORMATO_MSGPACK: LectorMsgpack}
+_DESCOMPRESORES = {'gzip': DescompresorGzip, 'zstd': DescompresorZstd}
+
+
+async def elementos_desde_stream(
+    chunks: AsyncIterable[bytes],
+    formato: str = FORMATO_JSON,
+    compresion: Optional[str] = None
+) -> AsyncIterator:
+    """Mensajes del body, uno por uno, a medida que llegan los bytes (ver `negociar_formato`)."""
+    descompresor = _DESCOMPRESORES[compresion]() if compresion else None
+    lector = _LECTORES[formato]()
+
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        for datos in (descompresor.alimentar(chunk) if descompresor else (chunk,)):
+            for elemento in lector.alimentar(datos):
+                yield elemento
+
+    cola = descompresor.terminar() if descompresor else b''
+    for elemento in lector.alimentar(cola, final=True):
+        yield elemento
+
+
+def fila_mensaje(msg, usuario_id: str, device_id: Optional[str]) -> Dict:
+    """
+    Mensaje del teléfono (objeto o lista compacta en el orden de CAMPOS_MENSAJE)
+    -> fila de `mensajes_whatsapp` (entra pendiente de análisis).
+    Falta un campo o la lista no tiene el largo justo -> ErrorIngesta (400).
+    """
+    try:
+        if isinstance(msg, (list, tuple)):
+            id_mensaje, chat_id, chat_nombre, contenido, timestamp, es_mio, tipo = msg
+        else:
+            id_mensaje, chat_id, chat_nombre = msg['id'], msg['chatId'], msg['chatNombre']
+            contenido, timestamp, es_mio, tipo = msg['contenido'], msg['timestamp'], msg['esMio'], msg['tipo']
+    except KeyError as e:
+        raise ErrorIngesta(f"mensaje sin el campo {e}")
+    except (TypeError, ValueError):
+        raise ErrorIngesta(f"mensaje mal formado: se esperaba un objeto o una lista de {len(CAMPOS_MENSAJE)} campos")
+    return {
+        'id': id_mensaje,
+        'usuario_id': usuario_id,
+        'chat_id': chat_id,
+        'chat_nombre': chat_nombre,
+        'contenido': contenido,
+        'timestamp': timestamp,
+        'es_mio': es_mio,
+        'tipo': tipo,
+        'device_id': device_id,
+        'sincronizado': True,
+        'procesado_ia': False
+    }
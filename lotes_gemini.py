@@ -0,0 +1,220 @@
+"""
+TRABAJOS POR LOTES DE GEMINI (Batch API)
+Para trabajo que NO necesita latencia interactiva (perfiles históricos):
+las solicitudes viajan en un archivo JSONL, el proveedor las procesa con
+su propia cuota de lotes y el resultado se lee cuando el trabajo termina.
+Así un backfill grande no le quita cuota por minuto al chat ni a la sync.
+
+Formato de cada línea (entrada):
+    {"key": "...", "request": {"contents": [...], "generation_config": {...}}}
+Formato de cada línea (salida):
+    {"key": "...", "response": {"candidates": [{"content": {"parts": [{"text": "..."}]}}]}}
+    {"key": "...", "error": {...}}
+"""
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+MODELO_LOTES = "gemini-2.5-flash"
+INTERVALO_SONDEO_LOTES_SEG = 60
+TIMEOUT_LOTES_SEG = 24 * 3600  # La Batch API garantiza resultado en <= 24h
+
+# Estados normalizados que devuelven los proveedores
+PENDIENTE = 'pendiente'
+COMPLETADO = 'completado'
+FALLIDO = 'fallido'
+
+
+class LoteFallidoError(RuntimeError):
+    """La Batch API dio el trabajo por fallido: no va a devolver resultados."""
+
+
+def construir_jsonl(
+    solicitudes: List[Tuple[str, str]],
+    ruta: str,
+    temperature: Optional[float] = None
+) -> str:
+    """Escribe las solicitudes (clave, prompt) como JSONL de la Batch API."""
+    config = {'response_mime_type': 'application/json'}
+    if temperature is not None:
+        config['temperature'] = temperature
+
+    with open(ruta, 'w', encoding='utf-8') as f:
+        for clave, prompt in solicitudes:
+            f.write(json.dumps({
+                'key': clave,
+                'request': {
+                    'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+                    'generation_config': config
+                }
+            }, ensure_ascii=False) + '\n')
+    return ruta
+
+
+def leer_resultados_jsonl(lineas: List[str]) -> Dict[str, Optional[str]]:
+    """{clave: texto de la respuesta} (None si esa solicitud falló)."""
+    resultados = {}
+    for linea in lineas:
+        if not linea.strip():
+            continue
+        try:
+            item = json.loads(linea)
+            clave = item['key']
+        except (ValueError, KeyError):
+            continue
+        try:
+            resultados[clave] = item['response']['candidates'][0]['content']['parts'][0]['text']
+        except (KeyError, IndexError, TypeError):
+            resultados[clave] = None
+    return resultados
+
+
+# ================================================================
+# PROVEEDORES
+# ================================================================
+
+class ProveedorLotesGemini:
+    """Batch API de Gemini (google-genai): files.upload + batches.create."""
+
+    def __init__(self, gemini_client, modelo: str = MODELO_LOTES):
+        self.client = gemini_client
+        self.modelo = modelo
+
+    def enviar(self, ruta_jsonl: str, nombre: str) -> str:
+        from google.genai import types
+
+        archivo = self.client.files.upload(
+            file=ruta_jsonl,
+            config=types.UploadFileConfig(display_name=nombre, mime_type='jsonl')
+        )
+        trabajo = self.client.batches.create(
+            model=self.modelo,
+            src=archivo.name,
+            config={'display_name': nombre}
+        )
+        return trabajo.name
+
+    def estado(self, trabajo_id: str) -> str:
+        trabajo = self.client.batches.get(name=trabajo_id)
+        estado = getattr(trabajo.state, 'name', str(trabajo.state))
+        if estado in ('JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED'):
+            return COMPLETADO
+        if estado in ('JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'):
+            return FALLIDO
+        return PENDIENTE
+
+    def resultados(self, trabajo_id: str) -> Dict[str, Optional[str]]:
+        trabajo = self.client.batches.get(name=trabajo_id)
+        contenido = self.client.files.download(file=trabajo.dest.file_name)
+        return leer_resultados_jsonl(contenido.decode('utf-8').splitlines())
+
+
+class ProveedorLotesLocal:
+    """
+    Sustituto local basado en archivos (desarrollo y pruebas): guarda la
+    entrada en `directorio` y, al primer sondeo, responde cada línea con
+    `responder(prompt) -> texto` y escribe la salida en el mismo formato
+    que la Batch API.
+    """
+
+    def __init__(self, responder: Callable[[str], str], directorio: str = None):
+        self.responder = responder
+        self.directorio = directorio or os.path.join(tempfile.gettempdir(), 'lotes_gemini')
+        os.makedirs(self.directorio, exist_ok=True)
+
+    def _ruta(self, trabajo_id: str, sufijo: str) -> str:
+        return os.path.join(self.directorio, f"{trabajo_id}.{sufijo}.jsonl")
+
+    def enviar(self, ruta_jsonl: str, nombre: str) -> str:
+        trabajo_id = f"{nombre}-{uuid.uuid4().hex[:8]}"
+        with open(ruta_jsonl, encoding='utf-8') as origen, \
+                open(self._ruta(trabajo_id, 'entrada'), 'w', encoding='utf-8') as destino:
+            destino.write(origen.read())
+        return trabajo_id
+
+    def estado(self, trabajo_id: str) -> str:
+        salida = self._ruta(trabajo_id, 'salida')
+        if os.path.exists(salida):
+            return COMPLETADO
+        if not os.path.exists(self._ruta(trabajo_id, 'entrada')):
+            return FALLIDO
+
+        with open(self._ruta(trabajo_id, 'entrada'), encoding='utf-8') as f, \
+                open(salida + '.tmp', 'w', encoding='utf-8') as out:
+            for linea in f:
+                if not linea.strip():
+                    continue
+                item = json.loads(linea)
+                prompt = item['request']['contents'][0]['parts'][0]['text']
+                try:
+                    respuesta = {'response': {'candidates': [
+                        {'content': {'parts': [{'text': self.responder(prompt)}]}}
+                    ]}}
+                except Exception as e:
+                    respuesta = {'error': {'message': str(e)}}
+                out.write(json.dumps({'key': item['key'], **respuesta}, ensure_ascii=False) + '\n')
+        os.replace(salida + '.tmp', salida)
+        return COMPLETADO
+
+    def resultados(self, trabajo_id: str) -> Dict[str, Optional[str]]:
+        with open(self._ruta(trabajo_id, 'salida'), encoding='utf-8') as f:
+            return leer_resultados_jsonl(f.readlines())
+
+
+# ================================================================
+# ENVÍO + SONDEO
+# ================================================================
+
+def enviar_lote(
+    proveedor,
+    solicitudes: List[Tuple[str, str]],
+    nombre: str,
+    temperature: Optional[float] = None
+) -> str:
+    """Arma el JSONL, lo envía y devuelve el id del trabajo."""
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta = construir_jsonl(solicitudes, os.path.join(carpeta, f"{nombre}.jsonl"), temperature)
+        trabajo_id = proveedor.enviar(ruta, nombre)
+    print(f"📦 Lote '{nombre}' enviado: {len(solicitudes)} solicitudes (trabajo {trabajo_id})")
+    return trabajo_id
+
+
+async def esperar_lote(
+    proveedor,
+    trabajo_id: str,
+    intervalo: float = INTERVALO_SONDEO_LOTES_SEG,
+    timeout: float = TIMEOUT_LOTES_SEG
+) -> Dict[str, Optional[dict]]:
+    """
+    Sondea el trabajo sin bloquear el event loop hasta que termine.
+
+    Returns:
+        {clave: JSON de la respuesta} (None si esa solicitud falló)
+
+    Raises:
+        LoteFallidoError si el trabajo falló; TimeoutError si no terminó a
+        tiempo (el trabajo puede seguir corriendo: se puede volver a sondear)
+    """
+    limite = time.monotonic() + timeout
+    while True:
+        estado = await asyncio.to_thread(proveedor.estado, trabajo_id)
+        if estado == COMPLETADO:
+            break
+        if estado == FALLIDO:
+            raise LoteFallidoError(f"El trabajo por lotes {trabajo_id} falló")
+        if time.monotonic() > limite:
+            raise TimeoutError(f"El trabajo por lotes {trabajo_id} no terminó a tiempo")
+        await asyncio.sleep(intervalo)
+
+    textos = await asyncio.to_thread(proveedor.resultados, trabajo_id)
+    resultados = {}
+    for clave, texto in textos.items():
+        try:
+            resultados[clave] = json.loads(texto) if texto else None
+        except ValueError:
+            resultados[clave] = None
+    return resultados
@@ -9,10 +9,12 @@ from fastapi.security import APIKeyHeader, HTTPBearer, HTTPAuthorizationCredenti
 from fastapi.middleware.cors import CORSMiddleware
 from gmail_service import GmailService
 from analizador_correos import AnalizadorCorreos
-import gzip
+from lotes_gemini import ProveedorLotesGemini
+import asyncio
 import pytesseract
 from PIL import Image
 import hashlib
+import hmac
 # --- FIX PARA CHROMADB EN RENDER/LINUX ---
 import sys
 __import__('pysqlite3')
@@ -53,7 +55,12 @@ from pydantic import BaseModel
 import jwt  # Se mantiene por compatibilidad con el archivo original
 from datetime import datetime, timedelta
 import pytz
-from contexto_extractor import ExtractorContexto, enriquecer_alerta_con_contexto
+from contexto_extractor import cerrar_pool_extractor, enriquecer_alerta_con_contexto, enriquecer_alertas_lote
+from ner_contexto import registrar_nlp
+from tarea_rapida import construir_tarea_rapida
+from ingesta_nexus import (
+    TAMANO_LOTE_UPSERT, ErrorIngesta, FormatoNoSoportado, elementos_desde_stream, fila_mensaje, negociar_formato
+)
 
 # ========== WHISPER CONFIG ==========
 
@@ -421,10 +428,13 @@ async def lifespan(app: FastAPI):
     
     print("🧠 Cargando modelo de lenguaje...")
     nlp = spacy.load("es_core_news_sm")
+    # El extractor de contexto usa este mismo pipeline para el NER por lotes
+    registrar_nlp(nlp)
     print("✅ NLP Listo")
     yield
     print("👋 Apagando sistema")
     scheduler.shutdown() # No olvides apagarlo al salir
+    cerrar_pool_extractor()
 
 app = FastAPI(title="Cerebro WhatsApp IA", lifespan=lifespan)
 # 👇 AGREGA ESTO AQUÍ 👇
@@ -663,13 +673,12 @@ async def procesar_informacion_valor(mensaje: str, clasificacion: Dict, usuario_
         
         if tareas_detectadas:
             alertas = []
-            for t in tareas_detectadas:
-                # 🔥 NUEVO: Enriquecer cada tarea
-                contexto_tarea = enriquecer_alerta_con_contexto(
-                    titulo=t.get('titulo', 'Recordatorio'),
-                    descripcion=t.get('descripcion', analisis['resumen_guardar'])
-                )
-
+            # 🔥 NUEVO: Enriquecer todas las tareas de una vez (NER en lote, fuera del event loop)
+            contextos_tareas = await asyncio.to_thread(enriquecer_alertas_lote, [
+                (t.get('titulo', 'Recordatorio'), t.get('descripcion', analisis['resumen_guardar']))
+                for t in tareas_detectadas
+            ])
+            for t, contexto_tarea in zip(tareas_detectadas, contextos_tareas):
                 alertas.append({
                     "usuario_id": usuario_id,
                     "conversacion_id": conv_id,
@@ -773,7 +782,6 @@ async def crear_tarea_directa(mensaje: str, usuario_id: str) -> Dict:
     fecha_actual = ahora.strftime("%Y-%m-%d %H:%M:%S (%A)")
 
     # --- 2. PRE-ANÁLISIS (Base del Código B) ---
-    extractor = ExtractorContexto()
     contexto = enriquecer_alerta_con_contexto(
         titulo="Procesando...", 
         descripcion=mensaje
@@ -855,21 +863,25 @@ async def crear_tarea_directa(mensaje: str, usuario_id: str) -> Dict:
 
     # --- 3. LLAMADA A IA (Estructura B con lógica de A) ---
     try:
-        if not gemini_client: raise Exception("Cliente Gemini no disponible")
+        # ⚡ Recordatorio simple y completo: lo arman las reglas, sin esperar a Gemini
+        lista_acciones = construir_tarea_rapida(mensaje, contexto, ahora)
 
-        resp = gemini_client.models.generate_content(
-            model=MODELO_IA,
-            contents=prompt,
-            config=types.GenerateContentConfig(response_mime_type="application/json")
-        )
+        if lista_acciones is None:
+            if not gemini_client: raise Exception("Cliente Gemini no disponible")
 
-        texto_limpio = resp.text.replace("```json", "").replace("```", "").strip()
-        lista_acciones = json.loads(texto_limpio)
-        
-        # Aseguramos que sea lista, incluso si la IA devuelve un solo objeto
-        if isinstance(lista_acciones, dict): lista_acciones = [lista_acciones]
+            resp = gemini_client.models.generate_content(
+                model=MODELO_IA,
+                contents=prompt,
+                config=types.GenerateContentConfig(response_mime_type="application/json")
+            )
+
+            texto_limpio = resp.text.replace("```json", "").replace("```", "").strip()
+            lista_acciones = json.loads(texto_limpio)
 
-        print(f"🤖 IA detectó {len(lista_acciones)} acciones.")
+            # Aseguramos que sea lista, incluso si la IA devuelve un solo objeto
+            if isinstance(lista_acciones, dict): lista_acciones = [lista_acciones]
+
+            print(f"🤖 IA detectó {len(lista_acciones)} acciones.")
 
         # --- 🔴 LÓGICA DE AGREGACIÓN (Del Código A adaptada a B) ---
         # Necesitamos elegir UNA acción principal para el título de la BD, 
@@ -1437,6 +1449,74 @@ async def actualizar_alerta(
     res = supabase.table('alertas').update(datos_actualizar).eq('id', alerta_id).execute()
     return {"status": "success", "data": res.data}
 
+@app.post("/api/alertas/reenriquecer")
+async def reenriquecer_alertas(
+    limite: int = 2000,
+    usuario_id: str = Depends(obtener_usuario_actual)
+):
+    """
+    BACKFILL: calcula el contexto (fecha/hora, lugar, personas, acciones
+    sugeridas) de las alertas que todavía no lo tienen, como las que crea el
+    Cerebro o las anteriores al extractor. Las fechas relativas se resuelven
+    desde el created_at de cada alerta. Con cientos de alertas el lote se
+    reparte en el pool de procesos del extractor, en un hilo aparte para no
+    frenar el event loop.
+    """
+    if not supabase:
+        raise HTTPException(status_code=500, detail="BD no disponible")
+
+    try:
+        filas = (await asyncio.to_thread(
+            supabase.table('alertas')
+            .select('id, titulo, descripcion, metadata, created_at')
+            .eq('usuario_id', usuario_id)
+            .order('created_at', desc=True)
+            .limit(limite)
+            .execute
+        )).data or []
+
+        zona_horaria = pytz.timezone('America/Lima')
+        pendientes = []
+        for fila in filas:
+            metadata = fila.get('metadata') or {}
+            if isinstance(metadata, str):
+                try:
+                    metadata = json.loads(metadata)
+                except ValueError:
+                    metadata = {}
+            if 'acciones_sugeridas' in metadata:
+                continue
+            try:
+                creada = datetime.fromisoformat(fila['created_at']).astimezone(zona_horaria)
+            except (KeyError, TypeError, ValueError):
+                creada = None
+            pendientes.append((fila, metadata, creada))
+
+        if not pendientes:
+            return {"status": "success", "revisadas": len(filas), "reenriquecidas": 0}
+
+        contextos = await asyncio.to_thread(
+            enriquecer_alertas_lote,
+            [(fila.get('titulo') or '', fila.get('descripcion') or '') for fila, _, _ in pendientes],
+            True,
+            [creada for _, _, creada in pendientes]
+        )
+
+        def _guardar():
+            # Lo que ya traía la alerta (origen, chat...) no se pisa
+            for (fila, metadata, _), contexto in zip(pendientes, contextos):
+                supabase.table('alertas').update({
+                    'metadata': {**serializar_universal(contexto), **metadata}
+                }).eq('id', fila['id']).execute()
+
+        await asyncio.to_thread(_guardar)
+        print(f"🧩 Backfill de contexto: {len(pendientes)}/{len(filas)} alertas")
+        return {"status": "success", "revisadas": len(filas), "reenriquecidas": len(pendientes)}
+
+    except Exception as e:
+        print(f"❌ Error en backfill de alertas: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # 🔥 WEBHOOK WHATSAPP (SIN AUTENTICACIÓN - Público para Twilio)
 @app.post("/webhook")
 async def webhook_whatsapp(request: Request):
@@ -1480,6 +1560,76 @@ async def webhook_whatsapp(request: Request):
 # Instancia global del analizador
 analizador_correos = AnalizadorCorreos()
 
+# Análisis profundo (borrador de respuesta) diferido hasta que el usuario abre
+# el correo; tras cada sync se precalientan en segundo plano los top-K críticos.
+ANALISIS_PROFUNDO_DIFERIDO = os.getenv('ANALISIS_PROFUNDO_DIFERIDO', 'true').lower() in ('1', 'true', 'si')
+PRECALENTAR_TOP_K = int(os.getenv('PRECALENTAR_TOP_K', '3'))
+# Perfiles del análisis histórico por la Batch API (más barato, sin cuota interactiva)
+HISTORICO_MODO_LOTE = os.getenv('HISTORICO_MODO_LOTE', 'false').lower() in ('1', 'true', 'si')
+
+_tareas_segundo_plano: set = set()  # Referencias vivas para que el GC no las cancele
+
+def lanzar_en_segundo_plano(corrutina):
+    tarea = asyncio.create_task(corrutina)
+    _tareas_segundo_plano.add(tarea)
+    tarea.add_done_callback(_tareas_segundo_plano.discard)
+    return tarea
+
+# ==============================================================================
+# 🚦 SINGLE-FLIGHT DE SINCRONIZACIÓN (una sola sync por cuenta a la vez)
+# ==============================================================================
+# Si Flutter reintenta o dos dispositivos abren la app juntos, solo UNA
+# sincronización por cuenta corre el pipeline completo. Las demás llamadas
+# esperan ese mismo resultado, y las que llegan dentro del intervalo mínimo
+# reciben las estadísticas de la última sync sin tocar Gmail ni la IA.
+INTERVALO_MINIMO_RESYNC_SEG = int(os.getenv('INTERVALO_MINIMO_RESYNC_SEG', '60'))
+
+_syncs_en_curso: Dict[str, asyncio.Task] = {}
+_ultima_sync_cuenta: Dict[str, tuple] = {}  # clave -> (instante_loop, respuesta)
+
+async def sincronizar_single_flight(clave: str, fabrica_sync) -> Dict:
+    """
+    Ejecuta `fabrica_sync()` como máximo una vez a la vez por `clave`.
+
+    Args:
+        clave: Identificador de la cuenta (usuario + email Gmail)
+        fabrica_sync: Función sin argumentos que devuelve la corrutina de sync
+
+    Returns:
+        La respuesta de la sync (propia, compartida o cacheada)
+    """
+    loop = asyncio.get_running_loop()
+    ahora = loop.time()
+
+    # 1. ¿Se sincronizó hace muy poco? Devolvemos lo último sin recalcular
+    cache = _ultima_sync_cuenta.get(clave)
+    if cache and ahora - cache[0] < INTERVALO_MINIMO_RESYNC_SEG:
+        print(f"♻️ Sync reciente para {clave} ({ahora - cache[0]:.0f}s). Devolviendo estadísticas en caché.")
+        return {
+            **cache[1],
+            "desde_cache": True,
+            "segundos_desde_ultima_sync": round(ahora - cache[0], 1)
+        }
+
+    # 2. ¿Ya hay una sync corriendo? Nos colgamos de ella en vez de lanzar otra
+    tarea = _syncs_en_curso.get(clave)
+    if tarea is None:
+        tarea = asyncio.create_task(fabrica_sync())
+        _syncs_en_curso[clave] = tarea
+
+        def _al_terminar(t: asyncio.Task):
+            _syncs_en_curso.pop(clave, None)
+            # Solo cacheamos éxitos: un error debe poder reintentarse de inmediato
+            if not t.cancelled() and t.exception() is None:
+                _ultima_sync_cuenta[clave] = (loop.time(), t.result())
+
+        tarea.add_done_callback(_al_terminar)
+    else:
+        print(f"⏳ Ya hay una sync en curso para {clave}. Esperando su resultado...")
+
+    # shield: si este cliente se desconecta, la sync sigue para los demás
+    return await asyncio.shield(tarea)
+
 # ==============================================================================
 # 📧 ENDPOINTS DE CORREOS (CON GMAIL API REAL)
 # ==============================================================================
@@ -1509,8 +1659,34 @@ async def sincronizar_correos(
     # ----------------------------------------
 
     try:
-        # 1. Obtener datos del request
         body = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Body JSON inválido")
+
+    # 🚦 Una sola sync por cuenta: los llamados concurrentes comparten resultado
+    clave_sync = f"{usuario_id}:{body.get('email_gmail') or ''}"
+    return await sincronizar_single_flight(
+        clave_sync,
+        lambda: _sincronizar_cuenta_gmail(
+            body, usuario_id, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, REDIRECT_URI
+        )
+    )
+
+
+async def _sincronizar_cuenta_gmail(
+    body: Dict,
+    usuario_id: str,
+    GOOGLE_CLIENT_ID: str,
+    GOOGLE_CLIENT_SECRET: str,
+    REDIRECT_URI: str
+) -> Dict:
+    """
+    Pipeline completo de sincronización de UNA cuenta Gmail
+    (canje de tokens, descarga, deduplicación, análisis IA y push).
+    Se invoca siempre a través de `sincronizar_single_flight`.
+    """
+    try:
+        # 1. Obtener datos del request
         gmail_token = body.get('gmail_access_token')
         email_gmail = body.get('email_gmail')
         server_auth_code = body.get('server_auth_code') # 🔥 NUEVO: Recibimos el código
@@ -1597,8 +1773,8 @@ async def sincronizar_correos(
         from gmail_service import GmailService
         gmail = GmailService(access_token=gmail_token)
         
-        # 4. Obtener correos no leídos (ESTO YA LO TIENES, DÉJALO IGUAL)
-        correos_gmail = gmail.obtener_correos_no_leidos(cantidad=50)
+        # 4. Listar correos no leídos (solo ids: los cuerpos se bajan en el flujo)
+        correos_gmail = gmail.listar_no_leidos(cantidad=50)
         
         if not correos_gmail:
             return {
@@ -1663,18 +1839,14 @@ async def sincronizar_correos(
             email = user_data.data[0].get('email', '')
             nombre_usuario = nombre if nombre else email.split('@')[0]
         
-        # 6. Procesar correos con el analizador inteligente
-        resultado = await analizador_correos.procesar_lote_correos(
-            correos=correos_a_procesar,
-            usuario_id=usuario_id,
-            gemini_client=gemini_client,
-            supabase_client=supabase,
-            nombre_usuario=nombre_usuario,
-            cuenta_gmail_id=cuenta_gmail_id  # 🔥 NUEVO: Pasar ID de cuenta
-        )
-        
-        # 7. Enviar notificaciones PUSH (solo correos críticos)
-        if resultado.get('correos_criticos'):
+        # 6. Enviar notificación PUSH del PRIMER correo crítico apenas se guarda
+        notificado = False
+
+        async def _notificar_critico(correo_top: Dict):
+            nonlocal notificado
+            if notificado:
+                return
+            notificado = True
             try:
                 fcm_data = supabase.table('usuarios')\
                     .select('fcm_token')\
@@ -1683,9 +1855,9 @@ async def sincronizar_correos(
                 
                 if fcm_data.data and fcm_data.data[0].get('fcm_token'):
                     token_fcm = fcm_data.data[0]['fcm_token']
-                    correo_top = resultado['correos_criticos'][0]
                     
-                    enviar_push(
+                    await asyncio.to_thread(
+                        enviar_push,
                         token=token_fcm,
                         titulo=f"📧 Correo Urgente: {correo_top['correo']['asunto'][:50]}...",
                         cuerpo=f"De: {correo_top['correo']['de']}\n{correo_top['clasificacion']['resumen_corto']}",
@@ -1697,6 +1869,25 @@ async def sincronizar_correos(
                     )
             except Exception as e_notif:
                 print(f"⚠️ Error enviando notificación: {e_notif}")
+
+        # 7. Procesar correos por etapas: descarga → filtro → IA → guardado
+        resultado = await analizador_correos.procesar_correos_en_flujo(
+            gmail.iterar_hilos(correos_a_procesar),
+            usuario_id=usuario_id,
+            gemini_client=gemini_client,
+            supabase_client=supabase,
+            nombre_usuario=nombre_usuario,
+            cuenta_gmail_id=cuenta_gmail_id,  # 🔥 NUEVO: Pasar ID de cuenta
+            al_persistir_critico=_notificar_critico,
+            analisis_diferido=ANALISIS_PROFUNDO_DIFERIDO
+        )
+        
+        # Borradores listos para los críticos que el usuario probablemente abra primero
+        if ANALISIS_PROFUNDO_DIFERIDO and PRECALENTAR_TOP_K > 0 and resultado.get('correos_criticos'):
+            lanzar_en_segundo_plano(analizador_correos.precalentar_analisis(
+                resultado['correos_criticos'], usuario_id, gemini_client, supabase,
+                top_k=PRECALENTAR_TOP_K
+            ))
         
         # 8. Retornar estadísticas
         return {
@@ -1706,10 +1897,23 @@ async def sincronizar_correos(
             "estadisticas": {
                 "procesados": resultado['procesados'],
                 "spam_descartado": resultado['spam_descartado'],
+                "descartado_modelo_local": resultado.get('descartado_modelo_local', 0),
+                "descartado_reputacion": resultado.get('descartado_reputacion', 0),
+                "directo_capa3_reputacion": resultado.get('directo_capa3_reputacion', 0),
+                "clasificados_ia": resultado.get('clasificados_capa2', 0),
+                "reutilizados_duplicado": resultado.get('reutilizados_duplicado', 0),
+                "tasa_reutilizacion": resultado.get('tasa_reutilizacion', 0.0),
+                "agrupados_en_hilo": resultado.get('agrupados_en_hilo', 0),
+                "analisis_diferidos": resultado.get('analisis_diferidos', 0),
                 "baja_prioridad": resultado['accion_baja'],
                 "media_prioridad": resultado['accion_media'],
                 "alta_prioridad": resultado['accion_alta']
             },
+            "etapas": resultado.get('etapas', {}),
+            "primer_critico_ms": resultado.get('primer_critico_ms'),
+            "primera_notificacion_ms": resultado.get('primera_notificacion_ms'),
+            "slo_prioridad_alta": resultado.get('slo_prioridad_alta'),
+            "metricas": resultado.get('metricas'),
             "correos_importantes": len(resultado['correos_criticos']),
             "top_correo": resultado['correos_criticos'][0]['correo']['asunto'] if resultado['correos_criticos'] else None
         }
@@ -1726,11 +1930,14 @@ async def analizar_historial_gmail_endpoint(
     """
     Analiza TODO el historial de Gmail (una sola vez por cuenta).
     Usa filtrado inteligente para reducir costos en 94%.
+    Con `modo_lote` los perfiles van por la Batch API: responde al instante
+    y el trabajo termina en segundo plano (reanudable por checkpoints).
     """
     try:
         body = await request.json()
         gmail_token = body.get('gmail_access_token')
         email_gmail = body.get('email_gmail')
+        modo_lote = bool(body.get('modo_lote', HISTORICO_MODO_LOTE))
         
         if not gmail_token or not email_gmail:
             raise HTTPException(status_code=400, detail="Token y email requeridos")
@@ -1741,14 +1948,23 @@ async def analizar_historial_gmail_endpoint(
         
         # 🔥 USAR VERSIÓN OPTIMIZADA
         from analizador_correos import analizar_historial_gmail_optimizado
-        resultado = await analizar_historial_gmail_optimizado(
+        trabajo = analizar_historial_gmail_optimizado(
             usuario_id=usuario_id,
             email_gmail=email_gmail,
             gmail_service=gmail,
             gemini_client=gemini_client,
-            supabase_client=supabase
+            supabase_client=supabase,
+            modo_lote=modo_lote,
+            proveedor_lotes=ProveedorLotesGemini(gemini_client) if modo_lote else None,
+            analizador=analizador_correos
         )
         
+        if modo_lote:
+            # La Batch API tarda minutos u horas: no retener la petición HTTP
+            lanzar_en_segundo_plano(trabajo)
+            return {"status": "en_proceso", "modo_lote": True, "email_gmail": email_gmail}
+        
+        resultado = await trabajo
         return resultado
     
     except Exception as e:
@@ -1813,6 +2029,49 @@ async def obtener_correos_pendientes(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Token de servicio para las métricas internas (header x-api-key). Sin él, el endpoint queda cerrado
+METRICAS_ADMIN_TOKEN = os.getenv('METRICAS_ADMIN_TOKEN')
+
+@app.get("/api/metricas/analizador")
+async def metricas_analizador(
+    api_key: str = Depends(api_key_header)
+):
+    """
+    Costo y latencia por capa del analizador de correos (llamadas y tokens de
+    Gemini, reintentos, esperas por 429, ms por correo, aciertos de cachés),
+    acumulados desde que arrancó el proceso.
+
+    Son de todo el servidor (mezclan el uso de todos los usuarios), así que no
+    basta con una sesión de usuario: se exige METRICAS_ADMIN_TOKEN en x-api-key.
+    """
+    if not METRICAS_ADMIN_TOKEN or not api_key or not hmac.compare_digest(api_key.encode(), METRICAS_ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Métricas solo disponibles con el token de servicio")
+    return analizador_correos.metricas.resumen()
+
+@app.get("/api/correos/{correo_id}/analisis")
+async def obtener_analisis_correo(
+    correo_id: str,
+    usuario_id: str = Depends(obtener_usuario_actual)
+):
+    """
+    Análisis profundo (borrador de respuesta, acciones, fecha límite) de un
+    correo. Si la sync lo dejó pendiente, se calcula ahora y queda guardado.
+    """
+    if not gemini_client:
+        raise HTTPException(status_code=500, detail="IA no disponible")
+
+    try:
+        analisis = await analizador_correos.obtener_analisis_profundo(
+            correo_id, usuario_id, gemini_client, supabase
+        )
+    except Exception as e:
+        print(f"❌ Error en análisis diferido: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if analisis is None:
+        raise HTTPException(status_code=404, detail="Correo no encontrado")
+    return {"correo_id": correo_id, **analisis}
+
 @app.patch("/api/correos/{correo_id}/marcar-leido")
 async def marcar_como_leido(
     correo_id: str, 
@@ -1988,11 +2247,14 @@ async def sincronizar_batch_nexus(
     x_batch_size: str = Header(None),
     x_device_id: str = Header(None),
     content_encoding: str = Header(None),
+    content_type: str = Header(None),
     authorization: str = Header(None) # 1. RECIBIMOS EL TOKEN AQUÍ
     
 ):
     """
     Recibe mensajes de WhatsApp, VALIDA EL USUARIO y los procesa.
+    Formato según Content-Type (JSON, NDJSON o MessagePack) y compresión según
+    Content-Encoding (gzip o zstd); ver ingesta_nexus.
     """
     
     # 2. VALIDAR AUTENTICACIÓN (CRÍTICO)
@@ -2018,41 +2280,39 @@ async def sincronizar_batch_nexus(
         raise HTTPException(status_code=401, detail="Error de autenticación")
 
     try:
-        # Descomprimir (Igual que antes)
-        body = await request.body()
-        if content_encoding == "gzip":
-            body = gzip.decompress(body)
-        mensajes_raw = json.loads(body)
-        
-        datos_para_insertar = []
-        
-        for msg in mensajes_raw:
-            # Preparamos el objeto para Supabase
-            datos_para_insertar.append({
-                'id': msg['id'],
-                'usuario_id': USER_ID_REAL, # Tu variable de usuario validado
-                'chat_id': msg['chatId'],
-                'chat_nombre': msg['chatNombre'],
-                'contenido': msg['contenido'],
-                'timestamp': msg['timestamp'],
-                'es_mio': msg['esMio'],
-                'tipo': msg['tipo'],
-                'device_id': x_device_id,
-                'sincronizado': True,
-                'procesado_ia': False # <--- ESTO ES LO NUEVO: Entran como "pendientes"
-            })
-
-        # Insertamos todo de golpe (Bulk Insert es más eficiente)
-        if datos_para_insertar:
-            supabase.table('mensajes_whatsapp').upsert(datos_para_insertar).execute()
-            print(f"✅ Ingesta Rápida: {len(datos_para_insertar)} mensajes guardados (Pendientes de análisis).")
+        # Streaming: se descomprime y parsea mientras llega el body, y se guarda
+        # en lotes de TAMANO_LOTE_UPSERT (memoria constante aunque el backlog sea enorme)
+        lote = []
+        total_guardados = 0
+        formato, compresion = negociar_formato(content_type, content_encoding)
+        mensajes = elementos_desde_stream(request.stream(), formato, compresion)
+
+        async for msg in mensajes:
+            lote.append(fila_mensaje(msg, USER_ID_REAL, x_device_id))
+            if len(lote) >= TAMANO_LOTE_UPSERT:
+                await asyncio.to_thread(supabase.table('mensajes_whatsapp').upsert(lote).execute)
+                total_guardados += len(lote)
+                lote = []
+
+        if lote:
+            await asyncio.to_thread(supabase.table('mensajes_whatsapp').upsert(lote).execute)
+            total_guardados += len(lote)
+
+        if total_guardados:
+            print(f"✅ Ingesta Rápida: {total_guardados} mensajes guardados (Pendientes de análisis).")
 
         return {
             "status": "success",
             "mode": "ingesta_rapida", # Confirmación de que no gastaste tokens
-            "mensajes_guardados": len(datos_para_insertar)
+            "mensajes_guardados": total_guardados
         }
-        
+
+    except FormatoNoSoportado as e:
+        print(f"❌ Formato de batch no soportado: {e}")
+        raise HTTPException(415, str(e))
+    except ErrorIngesta as e:
+        print(f"❌ Batch inválido: {e}")
+        raise HTTPException(400, f"Batch inválido: {str(e)}")
     except Exception as e:
         print(f"❌ Error en Batch: {e}")
         raise HTTPException(500, f"Error interno: {str(e)}")
@@ -0,0 +1,92 @@
+"""
+MÉTRICAS DE COSTO Y LATENCIA POR CAPA
+El diseño de 4 capas existe para gastar menos IA; estas métricas dicen
+cuánto gastó cada capa de verdad (llamadas, tokens, reintentos, esperas por
+429, milisegundos) y qué tan seguido acertaron los atajos (cachés), para
+evaluar cambios de umbral con datos.
+
+Dos niveles:
+    - Por lote: `procesar_correos_en_flujo` abre un `MetricasIA` propio y lo
+      deja en `_METRICAS_LOTE` (ContextVar), así las tareas y hilos del lote
+      suman ahí sin pasar el objeto por todas las funciones.
+    - Acumulado: `AnalizadorCorreos.metricas`, desde que arrancó el proceso.
+"""
+import os
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+CAPAS_METRICAS = ['capa1', 'capa2', 'capa3', 'historico']
+CACHES_METRICAS = ['ya_analizados', 'reputacion', 'duplicados', 'analisis_diferido']
+
+# Precio de gemini-2.5-flash (USD por millón de tokens) para estimar el costo
+PRECIO_ENTRADA_USD_MILLON = float(os.getenv('PRECIO_ENTRADA_USD_MILLON', '0.30'))
+PRECIO_SALIDA_USD_MILLON = float(os.getenv('PRECIO_SALIDA_USD_MILLON', '2.50'))
+
+_CONTADORES_CAPA = [
+    'correos', 'ms', 'llamadas_ia', 'reintentos', 'esperas_429', 'ms_espera_429',
+    'ms_ia', 'errores_ia', 'tokens_entrada', 'tokens_salida', 'tokens_total'
+]
+
+# Métricas del lote en curso (None fuera de un lote)
+_METRICAS_LOTE: ContextVar[Optional['MetricasIA']] = ContextVar('metricas_lote', default=None)
+
+
+class MetricasIA:
+    """Contadores por capa + aciertos/fallos de cada caché."""
+
+    def __init__(self):
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.desde = time.time()
+        self.lotes = 0
+        self.capas = {capa: dict.fromkeys(_CONTADORES_CAPA, 0) for capa in CAPAS_METRICAS}
+        self.caches = {cache: {'aciertos': 0, 'fallos': 0} for cache in CACHES_METRICAS}
+
+    def sumar(self, capa: str, **valores):
+        contadores = self.capas.setdefault(capa, dict.fromkeys(_CONTADORES_CAPA, 0))
+        for nombre, valor in valores.items():
+            contadores[nombre] = contadores.get(nombre, 0) + valor
+
+    def sumar_cache(self, cache: str, aciertos: int = 0, fallos: int = 0):
+        contadores = self.caches.setdefault(cache, {'aciertos': 0, 'fallos': 0})
+        contadores['aciertos'] += aciertos
+        contadores['fallos'] += fallos
+
+    def resumen(self) -> Dict:
+        """Foto serializable (JSON) con promedios, tasas y costo estimado."""
+        capas = {}
+        total_llamadas = 0
+        total_costo = 0.0
+        for capa, c in self.capas.items():
+            costo = (
+                c['tokens_entrada'] * PRECIO_ENTRADA_USD_MILLON
+                + c['tokens_salida'] * PRECIO_SALIDA_USD_MILLON
+            ) / 1_000_000
+            capas[capa] = {
+                **{k: round(v, 1) if isinstance(v, float) else v for k, v in c.items()},
+                'ms_por_correo': round(c['ms'] / c['correos'], 2) if c['correos'] else 0.0,
+                'ms_por_llamada_ia': round(c['ms_ia'] / c['llamadas_ia'], 1) if c['llamadas_ia'] else 0.0,
+                'costo_usd_estimado': round(costo, 6)
+            }
+            total_llamadas += c['llamadas_ia']
+            total_costo += costo
+
+        caches = {
+            cache: {
+                **c,
+                'tasa_acierto': round(c['aciertos'] / (c['aciertos'] + c['fallos']), 3)
+                if c['aciertos'] + c['fallos'] else 0.0
+            }
+            for cache, c in self.caches.items()
+        }
+
+        return {
+            'desde': self.desde,
+            'lotes': self.lotes,
+            'capas': capas,
+            'caches': caches,
+            'llamadas_ia_total': total_llamadas,
+            'costo_usd_estimado': round(total_costo, 6)
+        }
@@ -0,0 +1,337 @@
+"""
+MODELO LOCAL DE CAPA 1 (scikit-learn)
+Aprende de las etiquetas que Gemini ya puso en la Capa 2 para descartar
+correos sin valor SIN gastar una llamada a la IA.
+
+Uso offline:
+    python modelo_capa1.py entrenar [--usuario UUID] [--salida modelo_capa1.joblib]
+    python modelo_capa1.py evaluar  [--usuario UUID] [--modelo modelo_capa1.joblib] [--umbral 0.9]
+"""
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import joblib
+    import numpy as np
+    from scipy.sparse import csr_matrix, hstack
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.linear_model import LogisticRegression
+    SKLEARN_DISPONIBLE = True
+except ImportError:
+    SKLEARN_DISPONIBLE = False
+
+# Ruta del modelo entrenado y umbral de confianza para saltarse la IA
+RUTA_MODELO_CAPA1 = os.getenv('MODELO_CAPA1_PATH', 'modelo_capa1.joblib')
+UMBRAL_CONFIANZA_CAPA1 = float(os.getenv('MODELO_CAPA1_UMBRAL', '0.9'))
+
+# Señales de la Capa 1 que se usan como features numéricas
+SENALES_NUMERICAS = [
+    'remitente_spam', 'asunto_spam', 'cuerpo_corto', 'exceso_links', 'tiene_accion',
+    'mencion_directa', 'remitente_confiable', 'sin_html_pesado', 'tiene_baja'
+]
+
+
+def es_relevante(etiqueta: Dict) -> bool:
+    """Traduce la etiqueta de Gemini (Capa 2) a la clase del modelo."""
+    return bool(etiqueta.get('requiere_accion')) and etiqueta.get('categoria') != 'spam'
+
+
+def _dominio(remitente: str) -> str:
+    return remitente.split('@')[-1].lower() if remitente else ''
+
+
+class ModeloCapa1:
+    """
+    Clasificador binario "¿vale la pena gastar IA en este correo?".
+
+    Features:
+    - Texto (asunto + cuerpo) con hashing de uni/bigramas (sin vocabulario que guardar)
+    - Remitente y dominio como tokens
+    - Señales de la Capa 1 (`AnalizadorCorreos.extraer_senales`)
+    - Historial del remitente: cuántas veces Gemini lo etiquetó y qué % fue relevante
+    """
+
+    def __init__(self, umbral: float = UMBRAL_CONFIANZA_CAPA1):
+        self.umbral = umbral
+        self.clasificador = None
+        self.historial_remitentes: Dict[str, Tuple[int, int]] = {}  # remitente -> (total, relevantes)
+        self.entrenado_con = 0
+        self._vector_texto = HashingVectorizer(
+            n_features=2 ** 16, ngram_range=(1, 2), alternate_sign=False, norm='l2'
+        )
+        self._vector_remitente = HashingVectorizer(
+            n_features=2 ** 14, analyzer=str.split, alternate_sign=False, norm=None
+        )
+
+    def __getstate__(self):
+        # Los vectorizadores no tienen estado: no se guardan en el .joblib
+        estado = self.__dict__.copy()
+        estado.pop('_vector_texto', None)
+        estado.pop('_vector_remitente', None)
+        return estado
+
+    def __setstate__(self, estado):
+        self.__init__(umbral=estado.get('umbral', UMBRAL_CONFIANZA_CAPA1))
+        self.__dict__.update(estado)
+
+    # ================================================================
+    # FEATURES
+    # ================================================================
+
+    def _matriz(self, correos: List[Dict], senales: List[Dict]):
+        textos = [
+            f"{c.get('asunto', '')} {c.get('cuerpo', '')[:2000]}".lower()
+            for c in correos
+        ]
+        tokens_remitente = [
+            f"rem:{c.get('de', '').lower()} dom:{_dominio(c.get('de', ''))}"
+            for c in correos
+        ]
+
+        numericas = []
+        for c, s in zip(correos, senales):
+            total, relevantes = self.historial_remitentes.get(c.get('de', ''), (0, 0))
+            fila = [float(bool(s.get(nombre))) for nombre in SENALES_NUMERICAS]
+            fila += [
+                min(s.get('palabras_asunto', 0), 30) / 30.0,
+                math.log1p(total),
+                (relevantes + 1) / (total + 2),  # Tasa suavizada (0.5 si no hay historial)
+            ]
+            numericas.append(fila)
+
+        return hstack([
+            self._vector_texto.transform(textos),
+            self._vector_remitente.transform(tokens_remitente),
+            csr_matrix(np.asarray(numericas, dtype=np.float64))
+        ]).tocsr()
+
+    # ================================================================
+    # ENTRENAMIENTO / PREDICCIÓN
+    # ================================================================
+
+    def entrenar(self, correos: List[Dict], senales: List[Dict], relevantes: List[bool]):
+        """Entrena con correos ya etiquetados por Gemini."""
+        self.historial_remitentes = {}
+        for c, r in zip(correos, relevantes):
+            total, rel = self.historial_remitentes.get(c.get('de', ''), (0, 0))
+            self.historial_remitentes[c.get('de', '')] = (total + 1, rel + int(r))
+
+        self.clasificador = LogisticRegression(max_iter=1000, class_weight='balanced', C=4.0)
+        self.clasificador.fit(self._matriz(correos, senales), np.asarray(relevantes, dtype=int))
+        self.entrenado_con = len(correos)
+
+    def probabilidades_descartable(self, correos: List[Dict], senales: List[Dict]) -> List[float]:
+        """Probabilidad de que cada correo NO requiera acción (o sea spam)."""
+        if not correos:
+            return []
+        proba = self.clasificador.predict_proba(self._matriz(correos, senales))
+        idx_relevante = list(self.clasificador.classes_).index(1)
+        return [float(1.0 - p[idx_relevante]) for p in proba]
+
+    def decidir(self, correo: Dict, senales: Dict) -> Optional[bool]:
+        """
+        Returns:
+            True  -> seguro que es descartable (no gastar IA)
+            False -> seguro que es relevante (ir a la IA aunque el score sea bajo)
+            None  -> no está seguro (usar las reglas de siempre)
+        """
+        p_descartable = self.probabilidades_descartable([correo], [senales])[0]
+        if p_descartable >= self.umbral:
+            return True
+        if p_descartable <= 1.0 - self.umbral:
+            return False
+        return None
+
+    def reputacion_remitente(self, remitente: str) -> float:
+        """Tasa suavizada de correos relevantes del remitente (0.5 si no hay historial)."""
+        total, relevantes = self.historial_remitentes.get(remitente, (0, 0))
+        return (relevantes + 1) / (total + 2)
+
+    def guardar(self, ruta: str = RUTA_MODELO_CAPA1):
+        # Pickle guarda la ruta de la clase: si fuera "__main__.ModeloCapa1" el servidor no podría cargarlo
+        if type(self).__module__ == '__main__':
+            raise TypeError("ModeloCapa1 debe importarse desde modelo_capa1 para poder guardarse")
+        joblib.dump(self, ruta)
+
+
+_modelo_cargado: Dict[str, Optional[ModeloCapa1]] = {}
+
+def cargar_modelo_capa1(ruta: str = RUTA_MODELO_CAPA1) -> Optional[ModeloCapa1]:
+    """
+    Carga (una sola vez por proceso) el modelo entrenado.
+    Devuelve None si no hay scikit-learn o no existe el archivo: en ese caso
+    la Capa 1 sigue funcionando solo con reglas.
+    """
+    if ruta in _modelo_cargado:
+        return _modelo_cargado[ruta]
+
+    modelo = None
+    if SKLEARN_DISPONIBLE and os.path.exists(ruta):
+        try:
+            modelo = joblib.load(ruta)
+            print(f"✅ Modelo local de Capa 1 cargado ({modelo.entrenado_con} ejemplos, umbral {modelo.umbral})")
+        except Exception as e:
+            print(f"⚠️ No se pudo cargar el modelo de Capa 1 ({ruta}): {e}")
+
+    _modelo_cargado[ruta] = modelo
+    return modelo
+
+
+# ================================================================
+# DATOS DE ENTRENAMIENTO (etiquetas de Gemini en Supabase)
+# ================================================================
+
+def descargar_etiquetas(supabase_client, usuario_id: str = None, limite: int = 20000) -> List[Dict]:
+    """
+    Junta las etiquetas acumuladas de Gemini:
+    - `clasificaciones_capa2`: TODO lo que pasó por la Capa 2 (incluye 'baja' y 'spam')
+    - `correos_analizados`: correos que llegaron a la Capa 3 (siempre relevantes)
+    Un correo que pasó por la Capa 2 y llegó a la Capa 3 está en las dos
+    tablas: se toma una sola vez, por (remitente, asunto, extracto del cuerpo).
+
+    Returns:
+        [{'de', 'asunto', 'cuerpo', 'categoria', 'requiere_accion'}]
+    """
+    ejemplos = []
+    vistos: Dict[Tuple[str, str, str], int] = {}
+
+    q = supabase_client.table('clasificaciones_capa2')\
+        .select('remitente, asunto, cuerpo_extracto, categoria, requiere_accion')
+    if usuario_id:
+        q = q.eq('usuario_id', usuario_id)
+    for fila in q.limit(limite).execute().data:
+        ejemplo = {
+            'de': fila.get('remitente') or '',
+            'asunto': fila.get('asunto') or '',
+            'cuerpo': fila.get('cuerpo_extracto') or '',
+            'categoria': fila.get('categoria'),
+            'requiere_accion': fila.get('requiere_accion')
+        }
+        ejemplos.append(ejemplo)
+        if es_relevante(ejemplo):
+            clave = (ejemplo['de'].lower(), ejemplo['asunto'], ejemplo['cuerpo'][:800])
+            vistos[clave] = vistos.get(clave, 0) + 1
+
+    q = supabase_client.table('correos_analizados')\
+        .select('remitente, asunto, cuerpo_texto, categoria, requiere_accion')
+    if usuario_id:
+        q = q.eq('usuario_id', usuario_id)
+    for fila in q.limit(limite).execute().data:
+        ejemplo = {
+            'de': fila.get('remitente') or '',
+            'asunto': fila.get('asunto') or '',
+            'cuerpo': (fila.get('cuerpo_texto') or '')[:800],
+            'categoria': fila.get('categoria'),
+            # Llegó a Capa 3: Gemini dijo que requería acción en su momento
+            'requiere_accion': True
+        }
+        clave = (ejemplo['de'].lower(), ejemplo['asunto'], ejemplo['cuerpo'])
+        if vistos.get(clave):
+            vistos[clave] -= 1  # Ya está como etiqueta de la Capa 2
+            continue
+        ejemplos.append(ejemplo)
+
+    return ejemplos
+
+
+def evaluar_modelo(modelo: ModeloCapa1, ejemplos: List[Dict], senales: List[Dict]) -> Dict:
+    """
+    Métricas al umbral configurado, pensadas en "cuánta IA nos ahorramos":
+    - reduccion_capa2: % de correos que ya no irían a Gemini
+    - precision_descarte: de los descartados, % que realmente no requerían acción
+    - relevantes_perdidos: correos con acción que el modelo habría descartado
+    """
+    reales = [es_relevante(e) for e in ejemplos]
+    probas = modelo.probabilidades_descartable(ejemplos, senales)
+    descartados = [p >= modelo.umbral for p in probas]
+
+    total = len(ejemplos)
+    n_descartados = sum(descartados)
+    correctos = sum(1 for d, r in zip(descartados, reales) if d and not r)
+    perdidos = sum(1 for d, r in zip(descartados, reales) if d and r)
+    aciertos = sum(1 for p, r in zip(probas, reales) if (p < 0.5) == r)
+
+    return {
+        'ejemplos': total,
+        'umbral': modelo.umbral,
+        'exactitud': round(aciertos / total, 4) if total else 0,
+        'reduccion_capa2': round(100 * n_descartados / total, 2) if total else 0,
+        'precision_descarte': round(correctos / n_descartados, 4) if n_descartados else None,
+        'relevantes_perdidos': perdidos
+    }
+
+
+def _cli():
+    import argparse
+    import json
+    import random
+    from dotenv import load_dotenv
+    from supabase import create_client
+    from analizador_correos import AnalizadorCorreos
+    # Al correr como script este archivo es "__main__": se usa el módulo importable para que
+    # el .joblib referencie modelo_capa1.ModeloCapa1 y el servidor lo pueda cargar
+    import modelo_capa1
+
+    parser = argparse.ArgumentParser(description="Modelo local de Capa 1 (entrenar / evaluar)")
+    parser.add_argument('comando', choices=['entrenar', 'evaluar'])
+    parser.add_argument('--usuario', default=None, help="Entrenar solo con un usuario")
+    parser.add_argument('--salida', default=RUTA_MODELO_CAPA1)
+    parser.add_argument('--modelo', default=RUTA_MODELO_CAPA1)
+    parser.add_argument('--umbral', type=float, default=UMBRAL_CONFIANZA_CAPA1)
+    parser.add_argument('--holdout', type=float, default=0.2, help="Fracción para validación")
+    args = parser.parse_args()
+
+    if not SKLEARN_DISPONIBLE:
+        raise SystemExit("❌ scikit-learn no está instalado")
+
+    load_dotenv()
+    supabase_client = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'))
+    ejemplos = descargar_etiquetas(supabase_client, args.usuario)
+    if not ejemplos:
+        raise SystemExit("❌ No hay etiquetas de Gemini acumuladas todavía")
+
+    analizador = AnalizadorCorreos()
+    senales = [analizador.extraer_senales(e) for e in ejemplos]
+    print(f"📚 {len(ejemplos)} ejemplos ({sum(map(es_relevante, ejemplos))} relevantes)")
+
+    if args.comando == 'entrenar':
+        # 1. Validación con holdout (el historial de remitentes sale solo del train)
+        indices = list(range(len(ejemplos)))
+        random.Random(7).shuffle(indices)
+        corte = int(len(indices) * (1 - args.holdout))
+        train, test = indices[:corte], indices[corte:]
+
+        modelo = modelo_capa1.ModeloCapa1(umbral=args.umbral)
+        if test and len({es_relevante(ejemplos[i]) for i in train}) == 2:
+            modelo.entrenar([ejemplos[i] for i in train], [senales[i] for i in train],
+                            [es_relevante(ejemplos[i]) for i in train])
+            metricas = evaluar_modelo(modelo, [ejemplos[i] for i in test], [senales[i] for i in test])
+            print(f"🧪 Holdout: {json.dumps(metricas, ensure_ascii=False)}")
+
+        # 2. Modelo final con TODOS los datos
+        modelo.entrenar(ejemplos, senales, [es_relevante(e) for e in ejemplos])
+        modelo.guardar(args.salida)
+        print(f"💾 Modelo guardado en {args.salida}")
+
+        # 3. Ida y vuelta: cargarlo como lo hace el servidor y comparar predicciones
+        cargado = modelo_capa1.cargar_modelo_capa1(args.salida)
+        muestra_correos, muestra_senales = ejemplos[:200], senales[:200]
+        if cargado is None or not np.allclose(
+            cargado.probabilidades_descartable(muestra_correos, muestra_senales),
+            modelo.probabilidades_descartable(muestra_correos, muestra_senales)
+        ):
+            raise SystemExit(f"❌ El modelo guardado en {args.salida} no se carga igual en el servidor")
+        print("✅ Verificado: el servidor carga el modelo con las mismas predicciones")
+
+    else:
+        modelo = modelo_capa1.cargar_modelo_capa1(args.modelo)
+        if modelo is None:
+            raise SystemExit(f"❌ No se pudo cargar el modelo {args.modelo}")
+        modelo.umbral = args.umbral
+        metricas = evaluar_modelo(modelo, ejemplos, senales)
+        print(f"📊 Evaluación: {json.dumps(metricas, ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    _cli()
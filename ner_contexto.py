@@ -0,0 +1,90 @@
+"""
+NER CON SPACY PARA EL EXTRACTOR DE CONTEXTO
+Personas (PER) y lugares (LOC) con el modelo es_core_news_sm que `lifespan`
+ya carga al arrancar. Solo quedan activos tok2vec + ner (el parser, el
+lematizador, etc. no aportan nada aquí y son la mayor parte del costo), y
+los textos se procesan por lotes con `nlp.pipe`.
+
+Si spaCy o el modelo no están, `entidades_lote` devuelve None y el
+extractor sigue con sus regex de siempre.
+"""
+import os
+import threading
+from typing import Dict, List, Optional
+
+try:
+    import spacy
+    SPACY_DISPONIBLE = True
+except ImportError:
+    SPACY_DISPONIBLE = False
+
+MODELO_SPACY = os.getenv('SPACY_MODELO', 'es_core_news_sm')
+TAMANO_LOTE_NER = int(os.getenv('SPACY_BATCH_SIZE', '64'))
+PROCESOS_NER = int(os.getenv('SPACY_PROCESOS', '1'))  # >1: nlp.pipe reparte en procesos (cada uno carga el modelo)
+
+COMPONENTES_NER = ('tok2vec', 'ner')
+ETIQUETAS_PERSONA = {'PER', 'PERSON'}
+ETIQUETAS_LUGAR = {'LOC', 'GPE'}
+
+_nlp = None
+_carga_fallida = False
+_candado_nlp = threading.Lock()
+
+
+def _solo_ner(nlp):
+    """Deja activos únicamente los componentes que usa el NER."""
+    activos = [nombre for nombre in COMPONENTES_NER if nombre in nlp.pipe_names]
+    nlp.select_pipes(enable=activos)
+    return nlp
+
+
+def registrar_nlp(nlp):
+    """Reutiliza el pipeline que ya cargó la app (evita cargar el modelo dos veces)."""
+    global _nlp
+    with _candado_nlp:
+        _nlp = _solo_ner(nlp) if nlp is not None else None
+    return _nlp
+
+
+def obtener_nlp():
+    """Pipeline compartido; se carga la primera vez que se pide (None si no hay spaCy/modelo)."""
+    global _nlp, _carga_fallida
+    if _nlp is None and SPACY_DISPONIBLE and not _carga_fallida:
+        with _candado_nlp:
+            if _nlp is None and not _carga_fallida:
+                try:
+                    _nlp = _solo_ner(spacy.load(MODELO_SPACY))
+                    print(f"✅ NER listo ({MODELO_SPACY}: {', '.join(_nlp.pipe_names)})")
+                except Exception as e:
+                    _carga_fallida = True
+                    print(f"⚠️ No se pudo cargar {MODELO_SPACY} para NER: {e}")
+    return _nlp
+
+
+def _sin_repetir(valores: List[str]) -> List[str]:
+    return list(dict.fromkeys(valores))
+
+
+def entidades_lote(
+    textos: List[str],
+    batch_size: int = TAMANO_LOTE_NER,
+    n_process: int = PROCESOS_NER
+) -> Optional[List[Dict[str, List[str]]]]:
+    """
+    [{'personas': [...], 'lugares': [...]}, ...] en el mismo orden que `textos`,
+    o None si el NER no está disponible.
+    """
+    nlp = obtener_nlp()
+    if nlp is None:
+        return None
+    try:
+        resultados = []
+        for doc in nlp.pipe(textos, batch_size=batch_size, n_process=n_process):
+            resultados.append({
+                'personas': _sin_repetir([e.text for e in doc.ents if e.label_ in ETIQUETAS_PERSONA]),
+                'lugares': _sin_repetir([e.text for e in doc.ents if e.label_ in ETIQUETAS_LUGAR])
+            })
+        return resultados
+    except Exception as e:
+        print(f"⚠️ Error en NER por lotes: {e}")
+        return None
@@ -0,0 +1,125 @@
+"""
+NOMENCLÁTOR DE LUGARES (gazetteer)
+Distritos, centros comerciales, clínicas, hospitales, universidades y lugares
+conocidos de Lima, cargados desde un archivo de datos (lugares_lima.json) y
+buscados en UNA pasada sobre el texto con un trie de palabras: el costo
+depende del largo del texto, no de cuántos lugares haya en la lista.
+
+Cada coincidencia trae el nombre normalizado y su posición en el texto:
+    {'nombre': 'Santiago de Surco', 'tipo': 'distrito', 'inicio': 12, 'fin': 17, 'texto': 'Surco'}
+"""
+import json
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional
+
+RUTA_LUGARES = os.getenv(
+    'LUGARES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lugares_lima.json')
+)
+
+# Sin tildes y en minúsculas, sin cambiar el largo del texto (las posiciones siguen valiendo)
+_SIN_TILDES = str.maketrans('áéíóúüñÁÉÍÓÚÜÑ', 'aeiouunAEIOUUN')
+_RE_PALABRA = re.compile(r'\w+')
+_FIN = None  # Clave del nodo del trie que guarda el lugar que termina ahí
+
+
+def normalizar(texto: str) -> str:
+    return texto.translate(_SIN_TILDES).lower()
+
+
+class Nomenclator:
+    """Trie de palabras normalizadas -> lugar (coincidencia más larga, de izquierda a derecha)."""
+
+    def __init__(self):
+        self.raiz: Dict = {}
+        self.total = 0
+
+    def agregar(self, nombre: str, tipo: str, alias: Iterable[str] = (), requiere_mayuscula: bool = False):
+        lugar = {'nombre': nombre, 'tipo': tipo, 'requiere_mayuscula': requiere_mayuscula}
+        for forma in (nombre, *alias):
+            nodo = self.raiz
+            for palabra in _RE_PALABRA.findall(normalizar(forma)):
+                nodo = nodo.setdefault(palabra, {})
+            nodo[_FIN] = lugar
+        self.total += 1
+
+    def buscar(self, texto: str) -> List[Dict]:
+        """Lugares mencionados en `texto`, en orden de aparición y sin solaparse."""
+        palabras = [(m.start(), m.end(), m.group()) for m in _RE_PALABRA.finditer(normalizar(texto))]
+        encontrados = []
+        i = 0
+        while i < len(palabras):
+            nodo = self.raiz
+            mejor, mejor_fin = None, i
+            j = i
+            while j < len(palabras):
+                nodo = nodo.get(palabras[j][2])
+                if nodo is None:
+                    break
+                j += 1
+                lugar = nodo.get(_FIN)
+                if lugar and (not lugar['requiere_mayuscula'] or texto[palabras[i][0]].isupper()):
+                    mejor, mejor_fin = lugar, j
+            if mejor:
+                inicio, fin = palabras[i][0], palabras[mejor_fin - 1][1]
+                encontrados.append({
+                    'nombre': mejor['nombre'],
+                    'tipo': mejor['tipo'],
+                    'inicio': inicio,
+                    'fin': fin,
+                    'texto': texto[inicio:fin]
+                })
+                i = mejor_fin
+            else:
+                i += 1
+        return encontrados
+
+    # ================================================================
+    # CARGA
+    # ================================================================
+
+    @classmethod
+    def desde_archivo(cls, ruta: str = RUTA_LUGARES) -> 'Nomenclator':
+        with open(ruta, encoding='utf-8') as f:
+            datos = json.load(f)
+        nomenclator = cls()
+        for lugar in datos.get('lugares', []):
+            nomenclator.agregar(
+                lugar['nombre'],
+                lugar.get('tipo', 'lugar'),
+                lugar.get('alias', ()),
+                bool(lugar.get('requiere_mayuscula'))
+            )
+        return nomenclator
+
+    @classmethod
+    def desde_listas(cls, distritos: Iterable[str], lugares: Iterable[str]) -> 'Nomenclator':
+        nomenclator = cls()
+        for distrito in distritos:
+            nomenclator.agregar(distrito, 'distrito')
+        for lugar in lugares:
+            nomenclator.agregar(lugar, 'lugar')
+        return nomenclator
+
+
+_nomenclator: Optional[Nomenclator] = None
+_candado_nomenclator = threading.Lock()
+
+
+def obtener_nomenclator(distritos_respaldo: Iterable[str] = (), lugares_respaldo: Iterable[str] = ()) -> Nomenclator:
+    """
+    Nomenclátor compartido, cargado una vez desde RUTA_LUGARES. Si el archivo
+    falta o está mal formado se arma con las listas de respaldo.
+    """
+    global _nomenclator
+    if _nomenclator is None:
+        with _candado_nomenclator:
+            if _nomenclator is None:
+                try:
+                    _nomenclator = Nomenclator.desde_archivo()
+                    print(f"🗺️ Nomenclátor cargado: {_nomenclator.total} lugares")
+                except Exception as e:
+                    print(f"⚠️ No se pudo cargar {RUTA_LUGARES} ({e}), usando la lista básica")
+                    _nomenclator = Nomenclator.desde_listas(distritos_respaldo, lugares_respaldo)
+    return _nomenclator
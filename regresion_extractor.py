@@ -0,0 +1,244 @@
+"""
+REGRESIÓN DEL EXTRACTOR DE CONTEXTO (precisión + latencia)
+Ejecutar con: python regresion_extractor.py [--repeticiones N] [--guardar-linea-base]
+
+Corre el corpus etiquetado (corpus_extractor.json) por las funciones del
+extractor y reporta:
+  - Precisión por campo (fecha, hora, dirección, lugar, teléfonos, tipo de
+    acción y acciones sugeridas) contra las etiquetas.
+  - Si la tarea rápida sin IA (tarea_rapida.py) acepta el mensaje y con qué
+    título/fecha, o si lo deja para Gemini (etiqueta null).
+  - Distribución de latencias por función (p50 / p95 / p99 / máx) con los
+    memos limpios en cada ronda, para medir el camino "en frío".
+
+Compara todo contra linea_base_extractor.json y termina con error si la
+precisión de algún campo baja más de la tolerancia o si el p95 de alguna
+función sube más del porcentaje permitido. Al cambiar patrones a propósito,
+regenerar la línea base con --guardar-linea-base y commitearla.
+"""
+import argparse
+import contextlib
+import json
+import os
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from contexto_extractor import (
+    TIMEZONE, _fecha_hora_memo, enriquecer_alerta_con_contexto, normalizar_telefono, obtener_extractor
+)
+from tarea_rapida import construir_tarea_rapida
+
+_DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+RUTA_CORPUS = os.getenv('EXTRACTOR_CORPUS_PATH', os.path.join(_DIRECTORIO, 'corpus_extractor.json'))
+RUTA_LINEA_BASE = os.getenv('EXTRACTOR_LINEA_BASE_PATH', os.path.join(_DIRECTORIO, 'linea_base_extractor.json'))
+
+# Cuánto se tolera antes de fallar (la latencia varía entre máquinas: margen amplio)
+TOLERANCIA_PRECISION = float(os.getenv('REGRESION_TOLERANCIA_PRECISION', '0.0'))  # Puntos (0-1) que puede bajar
+TOLERANCIA_LATENCIA = float(os.getenv('REGRESION_TOLERANCIA_LATENCIA', '0.5'))    # +50% sobre el p95 base
+
+CAMPOS = ('fecha', 'hora', 'direccion', 'lugar', 'telefonos', 'tipo_accion', 'acciones', 'tarea_rapida')
+
+
+# ================================================================
+# CORPUS
+# ================================================================
+
+def cargar_corpus(ruta: str = RUTA_CORPUS) -> Dict:
+    with open(ruta, encoding='utf-8') as f:
+        corpus = json.load(f)
+    corpus['referencia'] = TIMEZONE.localize(datetime.fromisoformat(corpus['fecha_referencia']))
+    return corpus
+
+
+def _predicciones(texto: str, referencia: datetime) -> Dict:
+    """Lo que devuelve el extractor para cada campo etiquetado, en el formato del corpus."""
+    extractor = obtener_extractor()
+    fecha_hora = extractor.extraer_fecha_hora(texto, referencia) or {}
+    ubicacion = extractor.extraer_ubicacion(texto) or {}
+    personas = extractor.extraer_personas(texto)
+    contexto = enriquecer_alerta_con_contexto("", texto, fecha_referencia=referencia)
+    tarea = construir_tarea_rapida(texto, contexto, referencia)
+    return {
+        'fecha': fecha_hora['fecha'].isoformat() if fecha_hora.get('fecha') else None,
+        'hora': fecha_hora['hora'].strftime('%H:%M') if fecha_hora.get('hora') else None,
+        'direccion': ubicacion.get('direccion'),
+        'lugar': ubicacion.get('lugar_nombre'),
+        'telefonos': [p['telefono'] for p in personas if p.get('telefono')],
+        'tipo_accion': extractor.detectar_tipo_accion(texto),
+        'acciones': contexto['acciones_sugeridas'],
+        'tarea_rapida': {'titulo': tarea[0]['titulo'], 'fecha_iso': tarea[0]['fecha_iso']} if tarea else None
+    }
+
+
+def _coincide(campo: str, esperado, obtenido) -> bool:
+    if campo == 'direccion' and esperado is not None:
+        return bool(obtenido) and esperado.lower() in obtenido.lower()
+    if campo == 'acciones':
+        return set(esperado) == set(obtenido)
+    return esperado == obtenido
+
+
+# ================================================================
+# PRECISIÓN
+# ================================================================
+
+def evaluar_precision(corpus: Dict, mostrar_fallos: bool = False) -> Dict[str, float]:
+    """Fracción de aciertos por campo (solo sobre los casos que etiquetan ese campo)."""
+    aciertos = {campo: 0 for campo in CAMPOS}
+    evaluados = {campo: 0 for campo in CAMPOS}
+    fallos = []
+    with _silencio():
+        for caso in corpus['casos']:
+            obtenido = _predicciones(caso['texto'], corpus['referencia'])
+            for campo, esperado in caso['esperado'].items():
+                evaluados[campo] += 1
+                if _coincide(campo, esperado, obtenido[campo]):
+                    aciertos[campo] += 1
+                else:
+                    fallos.append((caso['texto'], campo, esperado, obtenido[campo]))
+
+    if mostrar_fallos:
+        for texto, campo, esperado, obtenido in fallos:
+            print(f"   ✗ [{campo}] esperado={esperado!r} obtenido={obtenido!r} :: {texto[:70]}")
+    return {campo: round(aciertos[campo] / evaluados[campo], 4) for campo in CAMPOS if evaluados[campo]}
+
+
+# ================================================================
+# LATENCIA
+# ================================================================
+
+@contextlib.contextmanager
+def _silencio():
+    """El extractor imprime mucho: se descarta mientras se mide."""
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        yield
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def _funciones(referencia: datetime) -> Dict[str, Callable[[str], object]]:
+    extractor = obtener_extractor()
+    return {
+        'extraer_fecha_hora': lambda t: extractor.extraer_fecha_hora(t, referencia),
+        'extraer_ubicacion': extractor.extraer_ubicacion,
+        'extraer_personas': extractor.extraer_personas,
+        'enriquecer_alerta_con_contexto': lambda t: enriquecer_alerta_con_contexto("", t, fecha_referencia=referencia),
+    }
+
+
+def medir_latencias(corpus: Dict, repeticiones: int = 20) -> Dict[str, Dict[str, float]]:
+    """{funcion: {'p50_us', 'p95_us', 'p99_us', 'max_us'}} midiendo cada llamada por separado."""
+    textos = [caso['texto'] for caso in corpus['casos']]
+    resultados = {}
+    with _silencio():
+        obtener_extractor()  # Fuera de la medición: compilación y carga del nomenclátor
+        for nombre, funcion in _funciones(corpus['referencia']).items():
+            funcion(textos[0])
+            tiempos = []
+            for _ in range(repeticiones):
+                _fecha_hora_memo.cache_clear()
+                normalizar_telefono.cache_clear()
+                for texto in textos:
+                    inicio = time.perf_counter()
+                    funcion(texto)
+                    tiempos.append((time.perf_counter() - inicio) * 1e6)
+            resultados[nombre] = {
+                'p50_us': round(_percentil(tiempos, 0.50), 1),
+                'p95_us': round(_percentil(tiempos, 0.95), 1),
+                'p99_us': round(_percentil(tiempos, 0.99), 1),
+                'max_us': round(max(tiempos), 1)
+            }
+    return resultados
+
+
+# ================================================================
+# LÍNEA BASE
+# ================================================================
+
+def comparar_con_linea_base(
+    precision: Dict[str, float],
+    latencias: Dict[str, Dict[str, float]],
+    linea_base: Dict,
+    tolerancia_precision: float = TOLERANCIA_PRECISION,
+    tolerancia_latencia: float = TOLERANCIA_LATENCIA
+) -> List[str]:
+    """Mensajes de regresión (lista vacía = todo en orden)."""
+    regresiones = []
+    for campo, base in linea_base.get('precision', {}).items():
+        actual = precision.get(campo)
+        if actual is not None and actual < base - tolerancia_precision:
+            regresiones.append(f"precisión de '{campo}' bajó: {base:.2%} -> {actual:.2%}")
+    for funcion, base in linea_base.get('latencia', {}).items():
+        actual = latencias.get(funcion)
+        limite = base['p95_us'] * (1 + tolerancia_latencia)
+        if actual and actual['p95_us'] > limite:
+            regresiones.append(
+                f"p95 de {funcion} subió: {base['p95_us']:.1f} -> {actual['p95_us']:.1f} µs (límite {limite:.1f})"
+            )
+    return regresiones
+
+
+def cargar_linea_base(ruta: str = RUTA_LINEA_BASE) -> Optional[Dict]:
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def guardar_linea_base(precision: Dict, latencias: Dict, casos: int, ruta: str = RUTA_LINEA_BASE):
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump({'casos': casos, 'precision': precision, 'latencia': latencias}, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def _cli():
+    parser = argparse.ArgumentParser(description="Precisión y latencia del extractor contra el corpus etiquetado")
+    parser.add_argument('--corpus', default=RUTA_CORPUS)
+    parser.add_argument('--linea-base', default=RUTA_LINEA_BASE)
+    parser.add_argument('--repeticiones', type=int, default=20, help="Rondas por función para las latencias")
+    parser.add_argument('--guardar-linea-base', action='store_true', help="Guarda los resultados como nueva línea base")
+    parser.add_argument('--fallos', action='store_true', help="Muestra cada caso que no coincide con su etiqueta")
+    parser.add_argument('--tolerancia-precision', type=float, default=TOLERANCIA_PRECISION)
+    parser.add_argument('--tolerancia-latencia', type=float, default=TOLERANCIA_LATENCIA)
+    args = parser.parse_args()
+
+    corpus = cargar_corpus(args.corpus)
+    print(f"📚 Corpus: {len(corpus['casos'])} casos (referencia {corpus['fecha_referencia']})")
+
+    print("\n🎯 PRECISIÓN")
+    precision = evaluar_precision(corpus, mostrar_fallos=args.fallos)
+    for campo, valor in precision.items():
+        print(f"   {campo:<12} {valor:7.2%}")
+
+    print(f"\n⏱️ LATENCIA ({args.repeticiones} rondas, µs por llamada)")
+    latencias = medir_latencias(corpus, args.repeticiones)
+    print(f"   {'función':<32} {'p50':>8} {'p95':>8} {'p99':>8} {'máx':>8}")
+    for nombre, l in latencias.items():
+        print(f"   {nombre:<32} {l['p50_us']:8.1f} {l['p95_us']:8.1f} {l['p99_us']:8.1f} {l['max_us']:8.1f}")
+
+    if args.guardar_linea_base:
+        guardar_linea_base(precision, latencias, len(corpus['casos']), args.linea_base)
+        print(f"\n💾 Línea base guardada en {args.linea_base}")
+        return
+
+    linea_base = cargar_linea_base(args.linea_base)
+    if linea_base is None:
+        print(f"\n⚠️ No hay línea base en {args.linea_base} (crearla con --guardar-linea-base)")
+        return
+    regresiones = comparar_con_linea_base(
+        precision, latencias, linea_base, args.tolerancia_precision, args.tolerancia_latencia
+    )
+    if regresiones:
+        for mensaje in regresiones:
+            print(f"❌ {mensaje}")
+        raise SystemExit(1)
+    print("\n✅ Sin regresiones contra la línea base")
+
+
+if __name__ == "__main__":
+    _cli()
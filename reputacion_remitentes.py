@@ -0,0 +1,249 @@
+"""
+ÍNDICE DE REPUTACIÓN DE REMITENTES (por usuario, en memoria)
+La Capa 1 solo conocía una lista fija de dominios "serios". Con lo que ya
+sabemos de cada remitente decidimos en O(1), antes de gastar IA:
+    - 'importante' -> va directo a la Capa 3 (sin clasificación de Capa 2)
+    - 'ignorado'   -> se descarta sin llamar a la IA
+    - None         -> sin evidencia suficiente: mandan las reglas de siempre
+
+Fuentes (Supabase), leídas de forma incremental por `created_at`:
+    perfiles_contactos_gmail -> nivel_importancia del análisis histórico
+    clasificaciones_capa2    -> cuántos de sus correos requirieron acción
+    correos_analizados       -> críticos guardados (los que llegaron por
+                                reputación no cuentan: sería su propia evidencia)
+Un crítico que pasó por la Capa 2 está en las dos tablas: los relevantes se
+cuentan por (remitente, asunto) y cada correo suma una sola vez.
+`respondido` cambia después de insertar la fila, así que los respondidos se
+vuelven a contar completos en cada refresco. Una fracción de los correos con
+veredicto pasa igual por las reglas/IA (exploración) para que un remitente
+ignorado pueda recuperarse y uno importante no lo sea para siempre.
+"""
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+IMPORTANCIA_ALTA = 8          # nivel_importancia (1-10) del perfil para ir directo a Capa 3
+IMPORTANCIA_BAJA = 2          # ... y para ignorarlo
+MIN_EVIDENCIA_REPUTACION = 5  # correos etiquetados antes de fiarse de la tasa
+TASA_IMPORTANTE = 0.8
+MIN_RESPONDIDOS_IMPORTANTE = 2
+LIMITE_FILAS_REPUTACION = 5000
+REFRESCO_REPUTACION_SEG = 300
+TASA_EXPLORACION_REPUTACION = float(os.getenv('REPUTACION_EXPLORACION', '0.05'))  # Veredictos que se ignoran al azar
+MAX_INDICES_REPUTACION = int(os.getenv('REPUTACION_MAX_USUARIOS', '256'))         # Usuarios en memoria (LRU)
+
+IMPORTANTE = 'importante'
+IGNORADO = 'ignorado'
+
+# Índices vivos por usuario (el proceso atiende a varios usuarios); el menos usado sale primero
+_INDICES_REPUTACION: 'OrderedDict[str, IndiceReputacion]' = OrderedDict()
+_candado_indices = threading.Lock()  # Se llama desde hilos (asyncio.to_thread)
+
+
+class IndiceReputacion:
+    """
+    Reputación de los remitentes de UN usuario.
+
+    Cada entrada guarda los contadores y el veredicto ya calculado, así que
+    consultar un remitente es un solo acceso a diccionario.
+    """
+
+    def __init__(self, usuario_id: str):
+        self.usuario_id = usuario_id
+        self.remitentes: Dict[str, Dict] = {}
+        self.marcas: Dict[str, Optional[str]] = {}  # tabla -> último created_at leído
+        # (remitente, asunto) -> [relevantes vistos en Capa 2, en Capa 3]
+        self.relevantes_vistos: Dict[Tuple[str, str], List[int]] = {}
+        self.refrescado_en = 0.0
+        self.candado = threading.Lock()  # Un solo refresco a la vez (si no, las filas se contarían dos veces)
+
+    def _entrada(self, remitente: str) -> Dict:
+        clave = (remitente or '').lower()
+        entrada = self.remitentes.get(clave)
+        if entrada is None:
+            entrada = {'importancia': None, 'etiquetados': 0, 'relevantes': 0, 'respondidos': 0, 'veredicto': None}
+            self.remitentes[clave] = entrada
+        return entrada
+
+    @staticmethod
+    def _calcular_veredicto(entrada: Dict) -> Optional[str]:
+        importancia = entrada['importancia']
+        etiquetados = entrada['etiquetados']
+        if entrada['respondidos'] >= MIN_RESPONDIDOS_IMPORTANTE:
+            return IMPORTANTE
+        if importancia is not None and importancia >= IMPORTANCIA_ALTA:
+            return IMPORTANTE
+        if etiquetados >= MIN_EVIDENCIA_REPUTACION:
+            tasa = entrada['relevantes'] / etiquetados
+            if tasa >= TASA_IMPORTANTE:
+                return IMPORTANTE
+            if entrada['relevantes'] == 0 and entrada['respondidos'] == 0:
+                return IGNORADO
+        if importancia is not None and importancia <= IMPORTANCIA_BAJA and entrada['respondidos'] == 0:
+            return IGNORADO
+        return None
+
+    # ================================================================
+    # ACTUALIZACIÓN
+    # ================================================================
+
+    def registrar_perfil(self, remitente: str, nivel_importancia):
+        entrada = self._entrada(remitente)
+        try:
+            entrada['importancia'] = int(nivel_importancia)
+        except (TypeError, ValueError):
+            entrada['importancia'] = None
+        entrada['veredicto'] = self._calcular_veredicto(entrada)
+
+    def registrar_resultado(self, remitente: str, relevante: bool):
+        """Un correo del remitente ya etiquetado (Capa 2) o guardado (Capa 3)."""
+        entrada = self._entrada(remitente)
+        entrada['etiquetados'] += 1
+        entrada['relevantes'] += int(bool(relevante))
+        entrada['veredicto'] = self._calcular_veredicto(entrada)
+
+    def registrar_relevante(self, remitente: str, asunto: str, fuente: int):
+        """
+        Correo relevante visto en la Capa 2 (`fuente` 0) o guardado en la Capa 3
+        (`fuente` 1). El mismo correo aparece en ambas tablas: por cada
+        (remitente, asunto) se cuenta el máximo de las dos, no la suma.
+        """
+        conteo = self.relevantes_vistos.setdefault(((remitente or '').lower(), asunto or ''), [0, 0])
+        antes = max(conteo)
+        conteo[fuente] += 1
+        if max(conteo) > antes:
+            self.registrar_resultado(remitente, True)
+
+    def registrar_respondidos(self, remitentes: List[str]):
+        """Reemplaza los contadores de respondidos (marcar/revertir cambia filas ya leídas)."""
+        conteo: Dict[str, int] = {}
+        for remitente in remitentes:
+            clave = (remitente or '').lower()
+            conteo[clave] = conteo.get(clave, 0) + 1
+        for clave in conteo:
+            self._entrada(clave)
+        for clave, entrada in self.remitentes.items():
+            if entrada['respondidos'] != conteo.get(clave, 0):
+                entrada['respondidos'] = conteo.get(clave, 0)
+                entrada['veredicto'] = self._calcular_veredicto(entrada)
+
+    # ================================================================
+    # CONSULTA (O(1))
+    # ================================================================
+
+    def veredicto(self, remitente: str, exploracion: float = TASA_EXPLORACION_REPUTACION) -> Optional[str]:
+        """
+        Veredicto guardado; con probabilidad `exploracion` devuelve None para que
+        el correo junte evidencia nueva por el camino normal.
+        """
+        entrada = self.remitentes.get((remitente or '').lower())
+        if not entrada or (entrada['veredicto'] and random.random() < exploracion):
+            return None
+        return entrada['veredicto']
+
+    def puntaje(self, remitente: str) -> Optional[float]:
+        """Tasa suavizada de correos relevantes (None si no hay historial)."""
+        entrada = self.remitentes.get((remitente or '').lower())
+        if not entrada:
+            return None
+        if entrada['etiquetados']:
+            return (entrada['relevantes'] + 1) / (entrada['etiquetados'] + 2)
+        if entrada['importancia'] is not None:
+            return min(max(entrada['importancia'], 0), 10) / 10.0
+        return None
+
+    def perfil(self, remitente: str) -> Optional[Dict]:
+        return self.remitentes.get((remitente or '').lower())
+
+    # ================================================================
+    # CARGA INCREMENTAL DESDE SUPABASE
+    # ================================================================
+
+    def _leer_nuevas(self, supabase_client, tabla: str, columnas: str) -> List[Dict]:
+        """Filas de `tabla` creadas después de la última lectura (las más recientes si es la primera)."""
+        q = supabase_client.table(tabla)\
+            .select(f'{columnas}, created_at')\
+            .eq('usuario_id', self.usuario_id)
+        marca = self.marcas.get(tabla)
+        if marca:
+            q = q.gt('created_at', marca)
+        filas = q.order('created_at', desc=True).limit(LIMITE_FILAS_REPUTACION).execute().data or []
+        fechas = [f['created_at'] for f in filas if f.get('created_at')]
+        if fechas:
+            self.marcas[tabla] = max(fechas)
+        return filas
+
+    def _leer_respondidos(self, supabase_client) -> List[Dict]:
+        """Todos los correos respondidos (los más recientes), sin marca: el flag cambia después del insert."""
+        return supabase_client.table('correos_analizados')\
+            .select('remitente')\
+            .eq('usuario_id', self.usuario_id)\
+            .eq('respondido', True)\
+            .order('created_at', desc=True)\
+            .limit(LIMITE_FILAS_REPUTACION)\
+            .execute().data or []
+
+    def refrescar(self, supabase_client):
+        """Suma lo nuevo de cada fuente. Si una tabla falla, se sigue con las demás."""
+        try:
+            for fila in self._leer_nuevas(supabase_client, 'perfiles_contactos_gmail', 'remitente, nivel_importancia'):
+                self.registrar_perfil(fila.get('remitente'), fila.get('nivel_importancia'))
+        except Exception as e:
+            print(f"⚠️ Reputación: no se pudieron leer perfiles: {e}")
+
+        try:
+            for fila in self._leer_nuevas(
+                supabase_client, 'clasificaciones_capa2', 'remitente, asunto, categoria, requiere_accion'
+            ):
+                if fila.get('requiere_accion') and fila.get('categoria') != 'spam':
+                    self.registrar_relevante(fila.get('remitente'), fila.get('asunto'), 0)
+                else:
+                    self.registrar_resultado(fila.get('remitente'), False)
+        except Exception as e:
+            print(f"⚠️ Reputación: no se pudieron leer clasificaciones: {e}")
+
+        try:
+            for fila in self._leer_nuevas(supabase_client, 'correos_analizados', 'remitente, asunto, metadata'):
+                # Los que saltaron la Capa 2 por reputación no son evidencia nueva
+                if (fila.get('metadata') or {}).get('por_reputacion'):
+                    continue
+                # Llegó a Capa 3: requería acción (si ya se contó en la Capa 2, no suma)
+                self.registrar_relevante(fila.get('remitente'), fila.get('asunto'), 1)
+        except Exception as e:
+            print(f"⚠️ Reputación: no se pudieron leer correos analizados: {e}")
+
+        try:
+            self.registrar_respondidos([
+                fila.get('remitente') for fila in self._leer_respondidos(supabase_client)
+            ])
+        except Exception as e:
+            print(f"⚠️ Reputación: no se pudieron leer respondidos: {e}")
+
+        self.refrescado_en = time.monotonic()
+
+
+def obtener_indice_reputacion(
+    supabase_client,
+    usuario_id: str,
+    refresco_seg: float = REFRESCO_REPUTACION_SEG
+) -> IndiceReputacion:
+    """
+    Índice del usuario desde memoria; se carga la primera vez y después solo
+    lee las filas nuevas cuando pasó `refresco_seg` desde el último refresco.
+    """
+    with _candado_indices:
+        indice = _INDICES_REPUTACION.get(usuario_id)
+        if indice is None:
+            indice = IndiceReputacion(usuario_id)
+            _INDICES_REPUTACION[usuario_id] = indice
+            while len(_INDICES_REPUTACION) > MAX_INDICES_REPUTACION:
+                _INDICES_REPUTACION.popitem(last=False)
+        else:
+            _INDICES_REPUTACION.move_to_end(usuario_id)
+    with indice.candado:
+        if not indice.refrescado_en or time.monotonic() - indice.refrescado_en >= refresco_seg:
+            indice.refrescar(supabase_client)
+    return indice
@@ -0,0 +1,211 @@
+"""
+TAREA RÁPIDA (sin IA)
+Para recordatorios simples y completos ("recuérdame pagar la luz mañana a
+las 9") el extractor de contexto ya sabe la fecha, la hora y la intención:
+armamos la lista `acciones_programadas` con reglas y nos ahorramos la
+llamada a Gemini (segundos -> milisegundos).
+
+Solo se usa si la confianza pasa el umbral Y no hay señales de ambigüedad
+(varias horas o fechas, varias intenciones, conectores de secuencia, la
+hora ya pasó...). En cualquier duda se devuelve None y decide Gemini.
+"""
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from contexto_extractor import DIAS_SEMANA, MESES_ES
+
+UMBRAL_TAREA_RAPIDA = float(os.getenv('TAREA_RAPIDA_UMBRAL', '0.8'))
+LARGO_MAX_TAREA_RAPIDA = 140  # Mensajes más largos casi siempre traen más de una cosa
+
+# Peso de cada señal en la confianza (0-1)
+PESO_FECHA = 0.3
+PESO_HORA = 0.3
+PESO_INTENCION = 0.3
+PESO_FRASE_SIMPLE = 0.1
+
+# Verbos/frases que disparan cada intención (texto en minúsculas)
+DISPARADORES_ALARMA = (
+    'recuérdame', 'recuerdame', 'recordarme', 'recordatorio', 'avísame', 'avisame',
+    'despiértame', 'despiertame', 'alarma', 'despertador', 'no olvidar', 'que no se me olvide'
+)
+DISPARADORES_CALENDARIO = ('agendar', 'agéndame', 'agendame', 'agenda ', 'cita', 'reunión', 'reunion', 'evento', 'entrevista', 'calendario')
+# Intenciones que necesitan datos que las reglas no arman bien (links, contactos, montos): Gemini
+DISPARADORES_OTRAS = (
+    'meet', 'zoom', 'teams', 'videollamada', 'llamar', 'llámame', 'whatsapp', 'wsp',
+    'yape', 'yapear', 'plin', 'transferir', 'depositar', 'correo', 'email', 'mail',
+    'contacto', 'número', 'numero'
+)
+CONECTORES_SECUENCIA = (' y luego', ' luego ', ' después', ' despues', ' además', ' ademas', ' y también', ' y tambien', ';', '\n')
+PALABRAS_URGENCIA = ('urgente', 'importante', 'sin falta')
+PALABRAS_NEGOCIO = ('reunión', 'reunion', 'cliente', 'trabajo', 'oficina', 'jefe', 'proyecto', 'entrevista', 'factura')
+
+# Lo que se quita del mensaje para quedarse con el "qué" (título)
+_RE_DISPARADOR_INICIAL = re.compile(
+    r'^\s*(?:(?:por\s+favor|porfa|oye)[,\s]+)?'
+    r'(?:recuérdame|recuerdame|recordarme|avísame|avisame|despiértame|despiertame|agéndame|agendame|'
+    r'pon(?:me)?\s+(?:una\s+)?(?:alarma|recordatorio)|agenda(?:r)?|crea(?:r)?\s+(?:un\s+)?recordatorio)'
+    r'(?:\s+(?:para|que|de|a))*\s*',
+    re.IGNORECASE
+)
+# Menciones de fecha u hora, sin solaparse (para contarlas y quitarlas del título)
+_RE_EXPRESION_TEMPORAL = re.compile(
+    r'\b(?:(?P<fecha>'
+    r'pasado\s+mañana|hoy|mañana(?!\s+(?:de|por)\b)'
+    r'|(?:el\s+|este\s+|próximo\s+|proximo\s+)?(?:' + '|'.join(DIAS_SEMANA) + r')'
+    r'|(?:el\s+)?\d{1,2}\s+de\s+(?:' + '|'.join(MESES_ES) + r')(?:\s+del?\s+\d{4})?'
+    r'|(?:el\s+)?\d{1,2}/\d{1,2}/\d{4}'
+    r')|(?P<hora>'
+    r'(?:a\s+las?\s+)\d{1,2}(?::\d{2})?(?:\s*(?:am|pm|hrs?|horas))?(?:\s+de\s+la\s+(?:mañana|tarde|noche))?'
+    r'|\d{1,2}(?::\d{2}(?:\s*(?:am|pm|hrs?|horas))?|\s*(?:am|pm|hrs?|horas)|\s+de\s+la\s+(?:mañana|tarde|noche))'
+    r')|(?:en|por|de)\s+la\s+(?:mañana|tarde|noche))\b',
+    re.IGNORECASE
+)
+_RE_NUMERO = re.compile(r'\d{1,2}')
+# Formas que el extractor todavía interpreta mal (ver linea_base_extractor.json): mejor Gemini
+_RE_HORA_DOS_PUNTOS_AMPM = re.compile(r'\b\d{1,2}:\d{2}\s*(?:am|pm|a\.\s?m\.|p\.\s?m\.)', re.IGNORECASE)
+FRACCION_MAX_DIRECCION = 0.6  # Una "dirección" que cubre casi todo el mensaje es la frase entera, no un lugar
+_RE_ESPACIOS = re.compile(r'\s+')
+_PALABRAS_SUELTAS = {'a', 'de', 'para', 'que', 'el', 'la', 'las', 'y', 'en', 'por'}
+
+
+def _hay(texto: str, palabras) -> bool:
+    return any(p in texto for p in palabras)
+
+
+def _intencion(texto_lower: str) -> Optional[str]:
+    """'poner_alarma' / 'agendar_calendario', o None si no hay una sola intención clara."""
+    if _hay(texto_lower, DISPARADORES_OTRAS):
+        return None
+    alarma = _hay(texto_lower, DISPARADORES_ALARMA)
+    calendario = _hay(texto_lower, DISPARADORES_CALENDARIO)
+    if alarma == calendario:  # Ninguna o las dos: ambiguo
+        return None
+    return 'poner_alarma' if alarma else 'agendar_calendario'
+
+
+def _expresiones_temporales(texto_lower: str) -> Tuple[set, set]:
+    """(fechas distintas, horas distintas) mencionadas en el mensaje."""
+    fechas, horas = set(), set()
+    for m in _RE_EXPRESION_TEMPORAL.finditer(texto_lower):
+        if m.group('fecha'):
+            fechas.add(m.group('fecha'))
+        elif m.group('hora'):
+            horas.add(int(_RE_NUMERO.search(m.group('hora')).group()))
+    return fechas, horas
+
+
+def titulo_desde_mensaje(mensaje: str, direccion: Optional[str] = None, por_defecto: str = 'Recordatorio') -> str:
+    """'recuérdame pagar la luz mañana a las 9' -> 'Pagar la luz' (el lugar va en su propia acción)."""
+    titulo = mensaje.strip()
+    if direccion and direccion in titulo:
+        corte = titulo.index(direccion)
+        antes_en = titulo.lower().rfind(' en ', 0, corte)
+        titulo = titulo[:antes_en if antes_en >= 0 else corte]
+    titulo = _RE_DISPARADOR_INICIAL.sub('', titulo)
+    titulo = _RE_EXPRESION_TEMPORAL.sub(' ', titulo)
+    palabras = _RE_ESPACIOS.sub(' ', titulo).strip(' ,.;:!¿?').split(' ')
+    while palabras and palabras[0].lower() in _PALABRAS_SUELTAS:
+        palabras.pop(0)
+    while palabras and palabras[-1].lower() in _PALABRAS_SUELTAS:
+        palabras.pop()
+    titulo = ' '.join(palabras).strip(' ,.;:!¿?')
+    if not titulo:
+        return por_defecto
+    titulo = titulo[0].upper() + titulo[1:]
+    return titulo if len(titulo) <= 60 else titulo[:57].rstrip() + '...'
+
+
+def evaluar_tarea_rapida(mensaje: str, contexto: Dict, ahora: datetime) -> Tuple[float, Optional[str]]:
+    """
+    (confianza 0-1, motivo para NO usar reglas). Con motivo != None la tarea
+    va a Gemini aunque la confianza sea alta.
+    """
+    texto_lower = mensaje.lower()
+    fecha_hora = contexto.get('fecha_hora') or {}
+    intencion = _intencion(texto_lower)
+    simple = len(mensaje) <= LARGO_MAX_TAREA_RAPIDA and not _hay(texto_lower, CONECTORES_SECUENCIA)
+
+    confianza = (
+        PESO_FECHA * bool(fecha_hora.get('fecha'))
+        + PESO_HORA * bool(fecha_hora.get('hora'))
+        + PESO_INTENCION * bool(intencion)
+        + PESO_FRASE_SIMPLE * simple
+    )
+
+    if not intencion:
+        return confianza, 'intención ambigua o que necesita datos extra'
+    if not fecha_hora.get('fecha') or not fecha_hora.get('hora'):
+        return confianza, 'falta fecha u hora explícita'
+    if not simple:
+        return confianza, 'mensaje largo o con varias acciones'
+    if 'pasado mañana' in texto_lower or 'pasado manana' in texto_lower:
+        return confianza, '"pasado mañana" (el extractor lo toma como mañana)'
+    if _RE_HORA_DOS_PUNTOS_AMPM.search(texto_lower):
+        return confianza, 'hora con minutos y am/pm (el extractor ignora el pm)'
+    direccion = (contexto.get('ubicacion') or {}).get('direccion')
+    if direccion and len(direccion) >= FRACCION_MAX_DIRECCION * len(mensaje.strip()):
+        return confianza, 'la dirección detectada abarca casi todo el mensaje'
+    fechas, horas = _expresiones_temporales(texto_lower)
+    if len(fechas) > 1 or len(horas) > 1:
+        return confianza, 'varias fechas u horas'
+    if any(p.get('telefono') or p.get('email') for p in contexto.get('personas') or []):
+        return confianza, 'trae datos de contacto'
+    momento = datetime.combine(fecha_hora['fecha'], fecha_hora['hora'])
+    if momento < ahora.replace(tzinfo=None):
+        return confianza, 'la hora ya pasó'
+    return confianza, None
+
+
+def construir_tarea_rapida(
+    mensaje: str,
+    contexto: Dict,
+    ahora: datetime,
+    umbral: float = UMBRAL_TAREA_RAPIDA
+) -> Optional[List[Dict]]:
+    """
+    Lista de acciones con el MISMO formato que devuelve Gemini en
+    `crear_tarea_directa` (titulo, descripcion, tipo_accion, prioridad,
+    etiqueta, fecha_iso, dato_extra), o None si hay que preguntarle a la IA.
+    """
+    confianza, motivo = evaluar_tarea_rapida(mensaje, contexto, ahora)
+    if motivo or confianza < umbral:
+        print(f"🤖 Tarea a Gemini (confianza {confianza:.2f}): {motivo or 'bajo el umbral'}")
+        return None
+
+    texto_lower = mensaje.lower()
+    fecha_hora = contexto['fecha_hora']
+    fecha_iso = datetime.combine(fecha_hora['fecha'], fecha_hora['hora']).strftime("%Y-%m-%dT%H:%M:%S")
+    intencion = _intencion(texto_lower)
+    ubicacion = contexto.get('ubicacion') or {}
+    direccion = ubicacion.get('direccion')
+    titulo = titulo_desde_mensaje(mensaje, direccion, por_defecto='')
+    if not titulo:
+        print(f"🤖 Tarea a Gemini (confianza {confianza:.2f}): no se pudo armar un título")
+        return None
+    base = {
+        'prioridad': 'ALTA' if _hay(texto_lower, PALABRAS_URGENCIA) else 'MEDIA',
+        'etiqueta': 'NEGOCIO' if _hay(texto_lower, PALABRAS_NEGOCIO) else 'PERSONAL',
+        'fecha_iso': fecha_iso
+    }
+
+    acciones = [{
+        **base,
+        'titulo': titulo,
+        'descripcion': mensaje.strip(),
+        'tipo_accion': intencion,
+        'dato_extra': direccion
+    }]
+    # Igual que pide el prompt: si hay dirección o lugar, también el mapa
+    if direccion:
+        acciones.append({
+            **base,
+            'titulo': f"Ir a {ubicacion.get('lugar_nombre') or direccion}",
+            'descripcion': direccion,
+            'tipo_accion': 'ver_ubicacion',
+            'dato_extra': direccion
+        })
+
+    print(f"⚡ Tarea armada sin IA (confianza {confianza:.2f}): {titulo} @ {fecha_iso}")
+    return acciones